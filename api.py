@@ -1,26 +1,326 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, url_for
 from flask_cors import CORS
 from libs.excel_parser import ExcelParser
+from libs.result_cache import ResultCache, get_cache_key
+from libs.metrics import ParseMetrics, MetricsRegistry
+from libs.job_queue import JobQueue, JobQueueFull
+from libs.batch_parser import extract_zip_workbooks, iter_batch_results
+from libs.row_store import RowStore
+import cProfile
+import json
+import os
+import shutil
+import tempfile
 import time
 
 app = Flask(__name__)
 CORS(app)
 
+# number of processes used to map the sheets of a workbook in parallel, 0 or 1 maps them in the request's process
+SHEET_PROCESSES = int(os.environ.get('EXCELPARSER_SHEET_PROCESSES', '0'))
+
+# number of processes parsing the workbooks of a /batch request, 0 or 1 parses them one by one in the request's process
+BATCH_PROCESSES = int(os.environ.get('EXCELPARSER_BATCH_PROCESSES', '2'))
+
+# most workbooks, and most uncompressed bytes of them, the zips of a /batch request may extract to disk
+BATCH_ZIP_FILES = int(os.environ.get('EXCELPARSER_BATCH_ZIP_FILES', '1000'))
+BATCH_ZIP_BYTES = int(os.environ.get('EXCELPARSER_BATCH_ZIP_BYTES', str(512 * 1024 * 1024)))
+
+# results of previous uploads, EXCELPARSER_CACHE_DIR adds a tier shared by all workers of the host
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get('EXCELPARSER_CACHE_BYTES', str(64 * 1024 * 1024))),
+    directory=os.environ.get('EXCELPARSER_CACHE_DIR'),
+    max_disk_bytes=int(os.environ.get('EXCELPARSER_DISK_CACHE_BYTES', str(1024 * 1024 * 1024)))
+)
+
+# mapped sheets keyed by their fingerprint, so a new revision of a workbook only maps the sheets that changed
+sheet_cache = ResultCache(
+    max_bytes=int(os.environ.get('EXCELPARSER_SHEET_CACHE_BYTES', str(64 * 1024 * 1024))),
+    directory=os.environ.get('EXCELPARSER_SHEET_CACHE_DIR'),
+    max_disk_bytes=int(os.environ.get('EXCELPARSER_SHEET_DISK_CACHE_BYTES', str(1024 * 1024 * 1024)))
+)
+
+# requests sent with profile=1 are run under cProfile and their stats written here, profiling is off when unset
+PROFILE_DIR = os.environ.get('EXCELPARSER_PROFILE_DIR')
+
+metrics_registry = MetricsRegistry()
+
+# uploads sent to /jobs are parsed in the background by this many threads of the worker, and at most
+# EXCELPARSER_JOB_QUEUE jobs are queued or running before new ones get a 429. EXCELPARSER_JOBS_DIR shares
+# the jobs' states and results with the other workers of the host
+job_queue = JobQueue(
+    max_workers=int(os.environ.get('EXCELPARSER_JOB_WORKERS', '2')),
+    max_pending=int(os.environ.get('EXCELPARSER_JOB_QUEUE', '16')),
+    ttl=int(os.environ.get('EXCELPARSER_JOB_TTL', '600')),
+    directory=os.environ.get('EXCELPARSER_JOBS_DIR')
+)
+
+# uploads of jobs are kept in memory up to this size and in a temporary file above it
+JOB_SPOOL_BYTES = 16 * 1024 * 1024
+
+# rows of the workbooks sent to /rows, kept on disk and served a window at a time. The directory
+# can be shared by the workers of the host, the least recently used workbooks go above EXCELPARSER_ROWS_BYTES
+row_store = RowStore(
+    directory=os.environ.get('EXCELPARSER_ROWS_DIR', os.path.join(tempfile.gettempdir(), 'excelparser-rows')),
+    max_bytes=int(os.environ.get('EXCELPARSER_ROWS_BYTES', str(1024 * 1024 * 1024)))
+)
+
+# most rows a single /rows window may span
+MAX_WINDOW_ROWS = 1000
+
+def cache_result_chunks(cache_key, chunks, metrics):
+    # the streamed result is cached and its metrics recorded once it has been sent completely. Chunks are
+    # only kept while they fit in the memory tier, a larger result is streamed without being cached
+    sent_chunks = []
+    sent_size = 0
+    start_time = time.perf_counter()
+    for chunk in chunks:
+        if sent_chunks is not None:
+            sent_size += len(chunk)
+            if sent_size > result_cache.max_bytes:
+                sent_chunks = None
+            else:
+                sent_chunks.append(chunk)
+        yield chunk
+    metrics.add_timing("total", time.perf_counter() - start_time)
+    if sent_chunks is None:
+        metrics.count("result_cache_skipped")
+    metrics_registry.record(metrics)
+    if sent_chunks is None:
+        return
+    result_json = "".join(sent_chunks)
+    if not result_json.startswith('{"error"'):
+        result_cache.set(cache_key, result_json)
+
+def get_selected_sheets(form):
+    # comma separated sheet names or sheet numbers, every sheet when empty
+    sheets = [sheet.strip() for sheet in form.get('sheets', '').split(',') if sheet.strip()]
+    return sheets or None
+
+def get_parse_options(form):
+    # format=compact writes each distinct style once and has the cells refer to it, see libs/compact_format.py
+    # values=formatted writes the values as Excel shows them, see libs/number_format.py
+    return {
+        "engine": form.get('engine', 'openpyxl'),
+        "sheets": get_selected_sheets(form),
+        "cell_range": form.get('range') or None,
+        "output_format": form.get('format', 'verbose'),
+        "values": form.get('values', 'raw')
+    }
+
+def parse_with_profile(excel_parser, excel_file, parse_options, cache_key):
+    profile = cProfile.Profile()
+    result_json = profile.runcall(excel_parser.parse_xlsx_to_json_file, excel_file, processes=SHEET_PROCESSES, **parse_options)
+    profile_name = "%d-%s.prof" % (time.time() * 1000, cache_key[:12])
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile.dump_stats(os.path.join(PROFILE_DIR, profile_name))
+    return result_json, profile_name
+
 @app.route('/parse', methods=['POST'])
 def parse():
-    start_time = time.time()
+    start_time = time.perf_counter()
+    metrics = ParseMetrics()
 
     excel_file = request.files['file']
-    excel_parser = ExcelParser()
+    stream = request.form.get('stream') in ['1', 'true']
+    parse_options = get_parse_options(request.form)
+    with metrics.phase("cache"):
+        # the pool size does not change the result, so it is not part of the key
+        cache_key = get_cache_key(excel_file, parse_options)
+        cached_json, cache_tier = result_cache.get(cache_key)
+    headers = {"X-Cache": "HIT-" + cache_tier.upper() if cache_tier else "MISS"}
+    if cached_json is not None:
+        metrics.count("result_cache_hits")
+        metrics.add_timing("total", time.perf_counter() - start_time)
+        metrics_registry.record(metrics)
+        headers["Server-Timing"] = metrics.get_server_timing()
+        return Response(cached_json, mimetype='application/json' if stream else None, headers=headers)
+    metrics.count("result_cache_misses")
+
+    excel_parser = ExcelParser(metrics, sheet_cache)
+    if stream:
+        # sheets and rows are sent as they are mapped instead of after the whole workbook is done,
+        # so the timings are only recorded for the metrics endpoint
+        chunks = cache_result_chunks(cache_key, excel_parser.iter_xlsx_to_json(excel_file, **parse_options), metrics)
+        return Response(stream_with_context(chunks), mimetype='application/json', headers=headers)
     try:
-        result_json = excel_parser.parse_xlsx_to_json_file(excel_file)
-        print("--- %s seconds ---" % (time.time() - start_time))
+        if PROFILE_DIR and request.form.get('profile') in ['1', 'true']:
+            result_json, headers["X-Profile"] = parse_with_profile(excel_parser, excel_file, parse_options, cache_key)
+        else:
+            result_json = excel_parser.parse_xlsx_to_json_file(excel_file, processes=SHEET_PROCESSES, **parse_options)
+        metrics.add_timing("total", time.perf_counter() - start_time)
+        metrics_registry.record(metrics)
+        headers["Server-Timing"] = metrics.get_server_timing()
         if result_json:
-            return result_json
+            if not result_json.startswith('{"error"'):
+                result_cache.set(cache_key, result_json)
+            return Response(result_json, headers=headers)
         else:
             return jsonify({"error": "Error parsing file"})
     except Exception as e:
         return jsonify({"error": str(e)})
 
+@app.route('/render', methods=['POST'])
+def render():
+    # the sheets as HTML tables, sent row by row. Values are shown as Excel shows them unless values=raw
+    excel_file = request.files['file']
+    parse_options = get_parse_options(request.form)
+    del parse_options["output_format"]
+    parse_options["values"] = request.form.get('values', 'formatted')
+    excel_parser = ExcelParser(ParseMetrics(), sheet_cache)
+    chunks = excel_parser.iter_xlsx_to_html(excel_file, **parse_options)
+    return Response(stream_with_context(chunks), mimetype='text/html')
+
+def run_parse_job(excel_file, parse_options, cache_key):
+    metrics = ParseMetrics()
+    try:
+        with metrics.phase("total"):
+            result_json = ExcelParser(metrics, sheet_cache).parse_xlsx_to_json_file(excel_file, processes=SHEET_PROCESSES, **parse_options)
+    finally:
+        excel_file.close()
+    metrics_registry.record(metrics)
+    if result_json.startswith('{"error"'):
+        raise ValueError(json.loads(result_json)["error"])
+    result_cache.set(cache_key, result_json)
+    return result_json
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    parse_options = get_parse_options(request.form)
+    # the upload is gone once the request ends, so the job gets its own copy
+    excel_file = tempfile.SpooledTemporaryFile(max_size=JOB_SPOOL_BYTES)
+    shutil.copyfileobj(request.files['file'].stream, excel_file)
+    cache_key = get_cache_key(excel_file, parse_options)
+    cached_json, _ = result_cache.get(cache_key)
+    try:
+        if cached_json is not None:
+            excel_file.close()
+            job_id = job_queue.add_result(cached_json)
+        else:
+            job_id = job_queue.submit(run_parse_job, excel_file, parse_options, cache_key)
+    except JobQueueFull as e:
+        excel_file.close()
+        metrics_registry.count("jobs_rejected")
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "10"}
+    metrics_registry.count("jobs_submitted")
+    return jsonify(job_queue.get_state(job_id)), 202, {"Location": url_for('get_job', job_id=job_id)}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    state = job_queue.get_state(job_id)
+    if state is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(state)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    state, result_json = job_queue.get_result(job_id)
+    if state is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if state["status"] == "failed":
+        return jsonify({"error": state["error"]})
+    if result_json is None:
+        return jsonify(state), 202
+    return Response(result_json, mimetype='application/json')
+
+def get_batch_line(name, result_json):
+    # one JSON document per line and file, a file that failed has its error instead of a result
+    if result_json.startswith('{"error"'):
+        return json.dumps({"file": name, "error": json.loads(result_json)["error"]}, ensure_ascii=False) + "\n"
+    return '{"file": ' + json.dumps(name, ensure_ascii=False) + ', "result": ' + result_json + '}\n'
+
+def iter_batch_lines(excel_files, parse_options, directory):
+    try:
+        pending_files, cache_keys = [], {}
+        for name, excel_path in excel_files:
+            with open(excel_path, 'rb') as excel_file:
+                cache_key = get_cache_key(excel_file, parse_options)
+            cached_json, _ = result_cache.get(cache_key)
+            if cached_json is not None:
+                metrics_registry.count("result_cache_hits")
+                yield get_batch_line(name, cached_json)
+            else:
+                metrics_registry.count("result_cache_misses")
+                cache_keys[excel_path] = cache_key
+                pending_files.append((excel_path, excel_path))
+        names = dict((excel_path, name) for name, excel_path in excel_files)
+        for excel_path, (result_json, timings, counters) in iter_batch_results(pending_files, parse_options, BATCH_PROCESSES):
+            metrics = ParseMetrics()
+            metrics.timings.update(timings)
+            metrics.merge_counters(counters)
+            metrics_registry.record(metrics)
+            if not result_json.startswith('{"error"'):
+                result_cache.set(cache_keys[excel_path], result_json)
+            yield get_batch_line(names[excel_path], result_json)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    # several "file" fields, each a workbook or a zip of workbooks. The results are sent as
+    # newline delimited JSON, one line per workbook in the order they finish
+    parse_options = get_parse_options(request.form)
+    directory = tempfile.mkdtemp(prefix="excelparser-batch-")
+    try:
+        excel_files = []
+        extracted_files, extracted_bytes = 0, 0
+        for upload in request.files.getlist('file'):
+            if upload.filename.lower().endswith('.zip'):
+                # the limits hold for all the zips of the request together
+                zip_files = extract_zip_workbooks(upload.stream, directory, BATCH_ZIP_BYTES - extracted_bytes, BATCH_ZIP_FILES - extracted_files)
+                extracted_files += len(zip_files)
+                extracted_bytes += sum(os.path.getsize(excel_path) for _, excel_path in zip_files)
+                excel_files += zip_files
+            else:
+                file_descriptor, excel_path = tempfile.mkstemp(dir=directory, suffix=".xlsx")
+                with os.fdopen(file_descriptor, 'wb') as excel_file:
+                    shutil.copyfileobj(upload.stream, excel_file)
+                excel_files.append((upload.filename, excel_path))
+    except Exception as e:
+        shutil.rmtree(directory, ignore_errors=True)
+        return jsonify({"error": str(e)})
+    if not excel_files:
+        shutil.rmtree(directory, ignore_errors=True)
+        return jsonify({"error": "No workbooks in the request"})
+    lines = iter_batch_lines(excel_files, parse_options, directory)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+@app.route('/rows', methods=['POST'])
+def store_rows():
+    # parses the workbook once and keeps its rows, the response has the sheets and their line counts but no lines.
+    # An upload already stored with the same options is not parsed again
+    excel_file = request.files['file']
+    parse_options = get_parse_options(request.form)
+    del parse_options["output_format"]
+    document_id = get_cache_key(excel_file, parse_options)
+    sheets = row_store.get_sheets(document_id)
+    if sheets is None:
+        metrics = ParseMetrics()
+        try:
+            with metrics.phase("total"):
+                sheets = row_store.write(document_id, ExcelParser(metrics, sheet_cache).iter_xlsx_sheets(excel_file, **parse_options))
+        except Exception as e:
+            return jsonify({"error": str(e)})
+        metrics_registry.record(metrics)
+    return jsonify({"document": document_id, "sheets": sheets})
+
+@app.route('/rows/<document_id>/<int:sheet_number>', methods=['GET'])
+def get_rows(document_id, sheet_number):
+    # the lines of rows start to start + count - 1, rows without a line are left out like in /parse
+    start = max(request.args.get('start', 1, type=int), 1)
+    count = min(max(request.args.get('count', 100, type=int), 0), MAX_WINDOW_ROWS)
+    lines_json = row_store.get_lines_json(document_id, sheet_number, start, count)
+    if lines_json is None:
+        return jsonify({"error": "Unknown document or sheet"}), 404
+    window = '{"sheetnumber": %d, "start": %d, "count": %d, "lines": ' % (sheet_number, start, count)
+    return Response(window + lines_json + "}", mimetype='application/json')
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # totals of this worker process, only served to local clients
+    if request.remote_addr not in ['127.0.0.1', '::1']:
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify(metrics_registry.snapshot())
+
 if __name__ == '__main__':
     app.run(debug=True)
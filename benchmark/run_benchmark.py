@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs.excel_parser import ExcelParser
+from libs.metrics import ParseMetrics
+from benchmark.workbook_generator import add_generator_arguments, generate_workbook, get_generator_options
+
+# Times ExcelParser on a synthetic workbook, with the phase timings the parser records, and optionally compares the run against a stored baseline.
+#   python -m benchmark.run_benchmark --rows 5000 --columns 30 --save-baseline benchmark/baseline.json
+#   python -m benchmark.run_benchmark --rows 5000 --columns 30 --baseline benchmark/baseline.json
+
+
+def count_cells(excel_path):
+    """Cells in the dimensions of every sheet of an existing workbook"""
+    workbook = openpyxl.load_workbook(excel_path, read_only=True)
+    try:
+        return sum((sheet.max_row or 0) * (sheet.max_column or 0) for sheet in workbook.worksheets)
+    finally:
+        workbook.close()
+
+
+def time_parse(excel_path, engine, processes, output_format):
+    """Returns the seconds and output bytes of one parse, and the timings of its phases as the parser records them"""
+    metrics = ParseMetrics()
+    start_time = time.perf_counter()
+    result_json = ExcelParser(metrics).parse_xlsx_to_json_file(excel_path, engine=engine, processes=processes, output_format=output_format)
+    return time.perf_counter() - start_time, len(result_json.encode("utf-8")), metrics.timings
+
+
+def measure_peak_memory(excel_path, engine, processes, output_format):
+    # only allocations made by Python are traced, and tracing slows the parse down, so it runs separately.
+    # with a pool, the allocations of the worker processes are not traced
+    tracemalloc.start()
+    try:
+        ExcelParser().parse_xlsx_to_json_file(excel_path, engine=engine, processes=processes, output_format=output_format)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(excel_path, cells, engine="openpyxl", processes=None, repeat=3, output_format="verbose"):
+    runs = [time_parse(excel_path, engine, processes, output_format) for _ in range(repeat)]
+    total_seconds = min(run[0] for run in runs)
+    return {
+        "engine": engine,
+        "processes": processes,
+        "output_format": output_format,
+        "output_bytes": runs[0][1],
+        "cells": cells,
+        "phases": dict((phase, min(run[2][phase] for run in runs)) for phase in runs[0][2]),
+        "total_seconds": total_seconds,
+        "cells_per_second": cells / total_seconds if total_seconds else 0,
+        "peak_memory_bytes": measure_peak_memory(excel_path, engine, processes, output_format)
+    }
+
+
+def get_setting_differences(result, baseline):
+    """Returns the settings of the run that differ from the ones the baseline was measured with"""
+    # baselines saved before the output format was an option were measured with the verbose one
+    baseline_settings = {"engine": "openpyxl", "processes": None, "output_format": "verbose"}
+    baseline_settings.update((name, baseline[name]) for name in baseline_settings if name in baseline)
+    return ["%s is %s, the baseline's is %s" % (name, result[name], value)
+            for name, value in baseline_settings.items() if result[name] != value]
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    """Returns the list of regressions of result against baseline"""
+    regressions = []
+    if result["cells_per_second"] < baseline["cells_per_second"] * (1 - tolerance):
+        regressions.append("throughput %.0f cells/sec is below the baseline %.0f cells/sec"
+                           % (result["cells_per_second"], baseline["cells_per_second"]))
+    if result["peak_memory_bytes"] > baseline["peak_memory_bytes"] * (1 + tolerance):
+        regressions.append("peak memory %d bytes is above the baseline %d bytes"
+                           % (result["peak_memory_bytes"], baseline["peak_memory_bytes"]))
+    return regressions
+
+
+def print_result(result):
+    print("engine: %s, processes: %s, format: %s, cells: %d"
+          % (result["engine"], result["processes"], result.get("output_format"), result["cells"]))
+    for phase, seconds in result["phases"].items():
+        print("  %-30s %10.4f s" % (phase, seconds))
+    print("  %-30s %10.4f s" % ("total", result["total_seconds"]))
+    print("  %-30s %10.0f" % ("cells/sec", result["cells_per_second"]))
+    print("  %-30s %10.1f MB" % ("peak memory", result["peak_memory_bytes"] / 1024 / 1024))
+    print("  %-30s %10.1f KB" % ("output", result.get("output_bytes", 0) / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ExcelParser on a synthetic workbook")
+    add_generator_arguments(parser)
+    parser.add_argument("--workbook", help="benchmark this workbook instead of generating one")
+    parser.add_argument("--engine", choices=["openpyxl", "stream"], default="openpyxl")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--format", choices=["verbose", "compact"], default="verbose")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save-baseline", help="write the result to this file")
+    parser.add_argument("--baseline", help="compare the result with this file and exit with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown or memory growth")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.workbook:
+            excel_path = args.workbook
+            cells = count_cells(excel_path)
+        else:
+            excel_path = os.path.join(directory, "benchmark.xlsx")
+            generator_options = get_generator_options(args)
+            cells = generate_workbook(excel_path, **generator_options)
+        result = run_benchmark(excel_path, cells, args.engine, args.processes, args.repeat, args.format)
+        result["workbook"] = args.workbook or generator_options
+
+    print_result(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(result, baseline_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("workbook") != result["workbook"]:
+            print("warning: the baseline was measured on a different workbook")
+        # runs with other settings are not comparable, their differences are not regressions
+        differences = get_setting_differences(result, baseline)
+        if differences:
+            print("not compared with the baseline:", "; ".join(differences))
+            sys.exit(2)
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+
+import openpyxl
+from openpyxl.styles import Alignment, Border, Color, Font, PatternFill, Side
+
+# Synthetic workbooks for measuring ExcelParser: size, merges, colors, borders and dates are all configurable.
+
+COLOR_MODES = ["theme", "rgb", "indexed", "mixed"]
+
+
+def get_color(color_mode, rand):
+    if color_mode == "mixed":
+        color_mode = rand.choice(["theme", "rgb", "indexed"])
+    if color_mode == "theme":
+        return Color(theme=rand.randint(0, 9), tint=rand.choice([0.0, 0.4, 0.8, -0.25, -0.5]))
+    if color_mode == "indexed":
+        return Color(indexed=rand.choice([2, 3, 4, 5, 10, 22, 63, 64]))
+    return Color(rgb="FF%06X" % rand.randint(0, 0xFFFFFF))
+
+
+def get_cell_value(row, column, date_density, rand):
+    if rand.random() < date_density:
+        return datetime(2020, 1, 1) + timedelta(days=row + column)
+    if rand.random() < 0.5:
+        return rand.randint(0, 100000)
+    return "r%dc%d" % (row, column)
+
+
+def fill_sheet(sheet, rows, columns, merge_density, color_mode, border_density, date_density, rand):
+    fonts = [Font(name=name, size=size, bold=bold, color=get_color(color_mode, rand))
+             for name in ["Arial", "Calibri"] for size in [10, 11, 14] for bold in [False, True]]
+    fills = [PatternFill("solid", start_color=get_color(color_mode, rand)) for _ in range(8)]
+    sides = [Side(style=style, color=get_color(color_mode, rand)) for style in ["thin", "medium", "thick", "double"]]
+    alignments = [Alignment(horizontal=horizontal, vertical=vertical)
+                  for horizontal in ["left", "center", "right"] for vertical in ["top", "center", "bottom"]]
+
+    for row in range(1, rows + 1):
+        for column in range(1, columns + 1):
+            cell = sheet.cell(row=row, column=column, value=get_cell_value(row, column, date_density, rand))
+            if rand.random() < 0.3:
+                cell.font = rand.choice(fonts)
+            if rand.random() < 0.3:
+                cell.fill = rand.choice(fills)
+            if rand.random() < 0.3:
+                cell.alignment = rand.choice(alignments)
+            if rand.random() < border_density:
+                side = rand.choice(sides)
+                cell.border = Border(top=side, right=side, bottom=side, left=side)
+
+    # merge_density is the share of cells that start a 2x2 merged range
+    occupied = set()
+    for row in range(1, rows, 2):
+        for column in range(1, columns, 2):
+            if rand.random() >= merge_density * 4:
+                continue
+            cells = [(row, column), (row + 1, column), (row, column + 1), (row + 1, column + 1)]
+            if occupied.intersection(cells):
+                continue
+            occupied.update(cells)
+            sheet.merge_cells(start_row=row, start_column=column, end_row=row + 1, end_column=column + 1)
+
+
+def generate_workbook(path, rows=1000, columns=20, sheets=1, merge_density=0.01, color_mode="mixed",
+                      border_density=0.2, date_density=0.1, seed=0):
+    """Writes a synthetic workbook to path and returns the number of cells it contains"""
+    rand = random.Random(seed)
+    workbook = openpyxl.Workbook()
+    for index in range(sheets):
+        sheet = workbook.active if index == 0 else workbook.create_sheet()
+        sheet.title = "sheet%d" % (index + 1)
+        fill_sheet(sheet, rows, columns, merge_density, color_mode, border_density, date_density, rand)
+    workbook.save(path)
+    return rows * columns * sheets
+
+
+def add_generator_arguments(parser):
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--sheets", type=int, default=1)
+    parser.add_argument("--merge-density", type=float, default=0.01)
+    parser.add_argument("--color-mode", choices=COLOR_MODES, default="mixed")
+    parser.add_argument("--border-density", type=float, default=0.2)
+    parser.add_argument("--date-density", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def get_generator_options(args):
+    return {
+        "rows": args.rows,
+        "columns": args.columns,
+        "sheets": args.sheets,
+        "merge_density": args.merge_density,
+        "color_mode": args.color_mode,
+        "border_density": args.border_density,
+        "date_density": args.date_density,
+        "seed": args.seed
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic workbook")
+    parser.add_argument("path")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+    print(generate_workbook(args.path, **get_generator_options(args)), "cells written to", args.path)
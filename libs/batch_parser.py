@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from libs.excel_parser import ExcelParser, pool_context
+from libs.metrics import ParseMetrics
+
+# Parses the workbooks of a batch concurrently and hands out each result as soon as it is done.
+# The parsers of a batch share one style cache per process, so workbooks made from the same template
+# (same styles and theme parts) resolve their styles once per process instead of once per file. The
+# cache lives as long as the batch: its workers are started for the batch, and a batch parsed in the
+# request's process gets a cache of its own.
+
+# style tables of the workbooks parsed by a worker process, see ExcelParser's style_cache
+worker_style_cache = None
+
+
+def init_batch_worker():
+    global worker_style_cache
+    worker_style_cache = {}
+
+
+def parse_batch_file(excel_path, parse_options, style_cache=None):
+    """Returns the result JSON of one workbook with the timings and counters of its parse,
+    style_cache defaults to the one of the worker process"""
+    metrics = ParseMetrics()
+    style_cache = worker_style_cache if style_cache is None else style_cache
+    with metrics.phase("total"):
+        result_json = ExcelParser(metrics, style_cache=style_cache).parse_xlsx_to_json_file(excel_path, **parse_options)
+    return result_json, metrics.timings, dict(metrics.counters)
+
+
+def get_error_result(error):
+    return json.dumps({"error": str(error)}, ensure_ascii=False), {}, {}
+
+
+def is_workbook_name(name):
+    base_name = os.path.basename(name)
+    return base_name.lower().endswith(".xlsx") and not base_name.startswith((".", "~$")) and not name.startswith("__MACOSX/")
+
+
+def extract_zip_workbooks(zip_file, directory, max_bytes, max_files):
+    """Writes the workbooks of a zip to directory and returns their (name in the zip, path). A zip whose
+    workbooks are more than max_files or add up to more than max_bytes uncompressed raises ValueError
+    before anything is written"""
+    excel_files = []
+    with zipfile.ZipFile(zip_file) as archive:
+        members = [member for member in archive.infolist() if not member.is_dir() and is_workbook_name(member.filename)]
+        # zipfile never inflates a member past its declared size, so the declared sizes bound what is written
+        if len(members) > max_files:
+            raise ValueError("Too many workbooks in the zip, the limit is %d" % max_files)
+        if sum(member.file_size for member in members) > max_bytes:
+            raise ValueError("The workbooks in the zip are too large, the limit is %d bytes" % max_bytes)
+        for member in members:
+            # the members are written under a name of our own, their paths are never used on disk
+            file_descriptor, excel_path = tempfile.mkstemp(dir=directory, suffix=".xlsx")
+            with archive.open(member) as source, os.fdopen(file_descriptor, "wb") as target:
+                shutil.copyfileobj(source, target)
+            excel_files.append((member.filename, excel_path))
+    return excel_files
+
+
+def iter_batch_results(excel_files, parse_options, processes):
+    """Yields (name, (result JSON, timings, counters)) for each of the (name, path) excel_files, in the order
+    they finish. With processes of 0 or 1 the files are parsed one after the other in this process"""
+    if not processes or processes <= 1 or len(excel_files) <= 1:
+        style_cache = {}
+        for name, excel_path in excel_files:
+            yield name, parse_batch_file(excel_path, parse_options, style_cache)
+        return
+    # workers start from the parser's fork server, like the sheet workers, not from a fork of this process
+    executor = ProcessPoolExecutor(max_workers=min(processes, len(excel_files)), mp_context=pool_context, initializer=init_batch_worker)
+    try:
+        futures = dict((executor.submit(parse_batch_file, excel_path, parse_options), name) for name, excel_path in excel_files)
+        for future in as_completed(futures):
+            # a worker that dies only fails its own file
+            try:
+                result = future.result()
+            except Exception as e:
+                result = get_error_result(e)
+            yield futures[future], result
+    finally:
+        # files not started yet are dropped when the consumer stops early
+        executor.shutdown(wait=True, cancel_futures=True)
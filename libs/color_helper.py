@@ -40,10 +40,14 @@ def rgb_to_hex(red, green=None, blue=None):
 
 def get_theme_colors(wb):
     """Gets theme colors from the workbook"""
+    return get_theme_colors_from_xml(wb.loaded_theme)
+
+def get_theme_colors_from_xml(theme_xml):
+    """Gets theme colors from the raw theme part (xl/theme/theme1.xml)"""
     # see: https://groups.google.com/forum/#!topic/openpyxl-users/I0k3TfqNLrc
     from openpyxl.xml.functions import QName, fromstring
     xlmns = 'http://schemas.openxmlformats.org/drawingml/2006/main'
-    root = fromstring(wb.loaded_theme)
+    root = fromstring(theme_xml)
     themeEl = root.find(QName(xlmns, 'themeElements').text)
     colorSchemes = themeEl.findall(QName(xlmns, 'clrScheme').text)
     firstColorScheme = colorSchemes[0]
@@ -68,8 +72,31 @@ def tint_luminance(tint, lum):
     else:
         return int(round(lum * (1.0 - tint) + (HLSMAX - HLSMAX * (1.0 - tint))))
 
+def tint_to_rgb(rgb, tint):
+    """Given a hex based rgb and a tint return the tinted hex based rgb"""
+    h, l, s = rgb_to_ms_hls(rgb)
+    return rgb_to_hex(ms_hls_to_rgb(h, tint_luminance(tint, l), s))
+
 def theme_and_tint_to_rgb(wb, theme, tint):
     """Given a workbook, a theme number and a tint return a hex based rgb"""
-    rgb = get_theme_colors(wb)[theme]
-    h, l, s = rgb_to_ms_hls(rgb)
-    return rgb_to_hex(ms_hls_to_rgb(h, tint_luminance(tint, l), s))
\ No newline at end of file
+    return tint_to_rgb(get_theme_colors(wb)[theme], tint)
+
+class ThemePalette:
+    """Theme colors of a workbook, parsed once, with memoized (theme, tint) -> hex lookups"""
+
+    def __init__(self, theme_xml):
+        self.colors = get_theme_colors_from_xml(theme_xml)
+        self.tinted = {}
+
+    @classmethod
+    def from_workbook(cls, wb):
+        return cls(wb.loaded_theme)
+
+    def theme_and_tint_to_rgb(self, theme, tint):
+        """Given a theme number and a tint return a hex based rgb"""
+        key = (theme, tint)
+        rgb = self.tinted.get(key)
+        if rgb is None:
+            rgb = tint_to_rgb(self.colors[theme], tint)
+            self.tinted[key] = rgb
+        return rgb
@@ -0,0 +1,60 @@
+# Compact output: every distinct cell style is written once in a workbook-level table and cells refer to it by index.
+#   {"format": "compact",
+#    "sheets": [{"sheetnumber", "sheetname", "font", "lines": [[linenumber, [[colnumber, value, style], ...]], ...]}],
+#    "styles": [{"alignment", "font", "border", "fill"}, ...]}
+# value and style are null when the cell has none. Merged cells add [colspan, rowspan], 1 when not spanned.
+# The styles have the same shape as the cells of the verbose format.
+
+STYLE_NAMES = ["alignment", "font", "border", "fill"]
+
+
+def get_style_key(cell_data):
+    # style dicts are flat except for border, whose sides are dicts as well
+    key = []
+    for name in STYLE_NAMES:
+        style = cell_data.get(name)
+        if name == "border" and style:
+            key.append(tuple((direction, tuple(side.items())) for direction, side in style.items()))
+        else:
+            key.append(tuple(style.items()) if style else None)
+    return tuple(key)
+
+
+class StyleTable:
+    """Distinct cell styles of a workbook in order of first use"""
+
+    def __init__(self):
+        self.styles = []
+        self.indices = {}
+
+    def get_index(self, cell_data):
+        """Returns the index of the cell's style, None when the cell has no style"""
+        key = get_style_key(cell_data)
+        if not any(key):
+            return None
+        index = self.indices.get(key)
+        if index is None:
+            index = len(self.styles)
+            self.styles.append(dict((name, cell_data[name]) for name in STYLE_NAMES if cell_data.get(name)))
+            self.indices[key] = index
+        return index
+
+
+def compact_line(line, style_table):
+    if not line:
+        return None
+    cells = []
+    for cell_data in line.get("columns", []):
+        cell = [cell_data["colnumber"], cell_data.get("value"), style_table.get_index(cell_data)]
+        if "colspan" in cell_data or "rowspan" in cell_data:
+            cell += [cell_data.get("colspan", 1), cell_data.get("rowspan", 1)]
+        cells.append(cell)
+    return [line["linenumber"], cells]
+
+
+def compact_sheets(sheet_data, style_table):
+    """Replaces the lines of the mapped sheets by their compact form, sheet by sheet"""
+    for sheet in sheet_data:
+        if sheet:
+            sheet["lines"] = [compact_line(line, style_table) for line in sheet["lines"]]
+    return sheet_data
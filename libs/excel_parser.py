@@ -1,68 +1,198 @@
 import openpyxl
 import json
-from libs.color_helper import theme_and_tint_to_rgb
-import zipfile
-import xml.etree.ElementTree as ET
+import hashlib
+from libs.color_helper import ThemePalette
+from libs.streaming_reader import StreamingWorkbook, StreamingWorksheet
+from libs.metrics import ParseMetrics
+from libs.selective_reader import load_selected_workbook
+from libs.compact_format import StyleTable, compact_line, compact_sheets
+from libs.sheet_fingerprint import get_sheet_fingerprints
+from libs.number_format import NumberFormats
+from libs.html_renderer import PAGE_START, PAGE_END, SheetTableWriter, get_error_page
+from libs.workbook_archive import WorkbookArchive, load_archive_workbook
+from openpyxl.utils.cell import range_boundaries
 import sys
-from datetime import datetime
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from openpyxl.xml.functions import fromstring, QName
+from openpyxl.xml.constants import ARC_STYLE, ARC_THEME
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.styles.colors import COLOR_INDEX
+from openpyxl.cell.cell import Cell
+
+logger = logging.getLogger(__name__)
+
+class SheetSelectionError(ValueError):
+    pass
+
+# worker pools start their processes from a fork server instead of forking the web worker, whose other
+# threads (jobs, logging) may hold a lock the child would then wait on forever. The server preloads the parser
+pool_context = multiprocessing.get_context("forkserver")
+pool_context.set_forkserver_preload(["libs.excel_parser"])
+
+# parser of the current sheet worker process, see ExcelParser.__map_sheets_in_pool
+sheet_worker_parser = None
+
+def init_sheet_worker(excel_path, shared_tables):
+    global sheet_worker_parser
+    sheet_worker_parser = ExcelParser()
+    sheet_worker_parser.open_for_sheet_worker(excel_path, shared_tables)
+
+def map_sheet_in_worker(index):
+    # counters of each sheet go back with its data, the parent reports them with its own
+    sheet_worker_parser.metrics = ParseMetrics()
+    return sheet_worker_parser.map_sheet_data(index), dict(sheet_worker_parser.metrics.counters)
 
 class ExcelParser:
     excel_path = None
+    archive = None
     workbook = None
     custom_index  = None
     current_sheet = None
     current_sheet_number = 0
     current_sheet_ranges = None
-    empty_rows = 0
-    empty_columns = 0
-
-    def __open_workbook(self, excel_path):
+    current_merged_cells = None
+    current_merged_anchors = None
+    style_table = None
+    theme_palette = None
+    border_table = None
+    current_borders = None
+    previous_row_cells = None
+    current_row_cells = None
+    next_row_cells = None
+    current_default_font = None
+    current_default_font_key = None
+    selected_sheets = None
+    value_format = "raw"
+    number_formats = None
+    cell_range = None
+    current_sheets = None
+    current_bounds = None
+
+    def __init__(self, metrics=None, sheet_cache=None, style_cache=None):
+        # sheet_cache (see libs.result_cache) keeps mapped sheets by fingerprint, so a new revision of
+        # a workbook only maps the sheets that changed. style_cache is a dict shared by the parsers of
+        # workbooks made from the same template, which then resolve their styles only once
+        self.metrics = metrics if metrics is not None else ParseMetrics()
+        self.sheet_cache = sheet_cache
+        self.style_cache = style_cache
+        self.cached_sheets = {}
+        self.sheet_json = {}
+        self.sheet_fingerprints = None
+
+    def __select_sheets(self, sheet_titles):
+        # selected sheets are names or sheet numbers (as in "sheetnumber"), a name wins over a number
+        if self.selected_sheets is None:
+            return list(range(len(sheet_titles)))
+        sheet_indices = set()
+        for sheet in self.selected_sheets:
+            if isinstance(sheet, str) and sheet in sheet_titles:
+                sheet_indices.add(sheet_titles.index(sheet))
+            elif isinstance(sheet, int) or sheet.isdigit():
+                if not 0 < int(sheet) <= len(sheet_titles):
+                    raise SheetSelectionError("Unknown sheet: " + str(sheet))
+                sheet_indices.add(int(sheet) - 1)
+            else:
+                raise SheetSelectionError("Unknown sheet: " + str(sheet))
+        return sorted(sheet_indices)
+
+    def __get_sheet_bounds(self):
+        # (min_column, min_row, max_column, max_row) of the requested range, within the sheet's extent
+        max_column, max_row = self.current_sheet.max_column, self.current_sheet.max_row
+        if self.cell_range is None:
+            return 1, 1, max_column, max_row
+        min_range_column, min_range_row, max_range_column, max_range_row = range_boundaries(self.cell_range)
+        return (
+            min_range_column or 1,
+            min_range_row or 1,
+            min(max_range_column or max_column, max_column),
+            min(max_range_row or max_row, max_row)
+        )
+
+    def __report_error(self, message):
+        # swallowed errors are logged with their cause and counted instead of printed
+        self.metrics.count("errors_swallowed")
+        logger.warning("%s: %r", message, sys.exc_info()[1])
+
+    def __select_sheets_to_map(self, sheet_titles):
+        return [index for index in self.__select_sheets(sheet_titles) if index not in self.cached_sheets]
+
+    def __open_workbook(self):
         try:
-            self.workbook = openpyxl.load_workbook(excel_path, data_only=True)
+            if self.selected_sheets is None and not self.cached_sheets:
+                self.workbook = load_archive_workbook(self.archive)
+            else:
+                # only the requested worksheets that are not cached are loaded
+                self.workbook, sheet_indices = load_selected_workbook(self.archive, self.__select_sheets_to_map)
+                self.current_sheets = list(zip(sheet_indices, self.workbook.worksheets))
+        except SheetSelectionError:
+            raise
         except:
-            print("Error opening workbook", sys.exc_info()[0])
+            self.__report_error("Error opening workbook")
             return None
 
-    def __set_custom_index(self, color):
+    def __open_streaming_workbook(self):
         try:
-            self.custom_index = [rgb.attrib['rgb'] for rgb in color]
+            self.workbook = StreamingWorkbook(self.archive)
         except:
-            print("Error setting custom index", sys.exc_info()[0])
+            self.__report_error("Error opening workbook")
             return None
 
-    def __check_for_custom_index(self, filepath):
+    def __check_for_custom_index(self):
+        # openpyxl has read the indexedColors of the stylesheet into the workbook, which keeps
+        # the default palette when there are none
         try:
-            with zipfile.ZipFile(filepath) as zgood:
-                styles_xml = zgood.read('xl/styles.xml')
-                root = ET.fromstring(styles_xml)
-                [[self.__set_custom_index(color) for color in child if 'indexedColors' in color.tag] for child in root if 'colors' in child.tag]
+            colors = self.__get_openpyxl_workbook()._colors
+            self.custom_index = colors if colors is not COLOR_INDEX else None
         except:
-            print("Error checking for custom index", sys.exc_info()[0])
+            self.__report_error("Error checking for custom index")
             return None
 
+    def __load_theme_palette(self):
+        try:
+            self.theme_palette = ThemePalette.from_workbook(self.workbook)
+        except:
+            self.__report_error("Error loading theme palette")
+            self.theme_palette = None
+
     def __get_default_font_data(self):
         try:
+            # Worksheet.cell would store A1 in the worksheet when the sheet does not have it
+            first_cell = None if isinstance(self.current_sheet, StreamingWorksheet) else self.current_sheet._cells.get((1, 1))
+            if first_cell is None:
+                first_cell = self.__get_blank_cell(1, 1)
             return {
-                "font": self.current_sheet.cell(row=1, column=1).font.name,
-                "size": int(self.current_sheet.cell(row=1, column=1).font.size)
+                "font": first_cell.font.name,
+                "size": int(first_cell.font.size)
             }
         except:
-            print("Error getting default font data", sys.exc_info()[0])
+            self.__report_error("Error getting default font data")
             return {}
 
-    def __is_merged_cell(self, cell, merged_ranges):
-        for merged_range in merged_ranges:
-            if cell.coordinate in merged_range:
-                self.current_range = {
-                    "columns": merged_range.size["columns"],
-                    "rows": merged_range.size["rows"]
-                }
-                return True
-        return False
+    def __index_merged_cells(self):
+        # (row, column) -> size of the merged range covering it, so a cell's merge state is a single lookup
+        self.current_merged_cells = {}
+        self.current_merged_anchors = set()
+        for merged_range in self.current_sheet_ranges:
+            merged_range_size = {
+                "columns": merged_range.size["columns"],
+                "rows": merged_range.size["rows"]
+            }
+            for row in range(merged_range.min_row, merged_range.max_row + 1):
+                for column in range(merged_range.min_col, merged_range.max_col + 1):
+                    self.current_merged_cells.setdefault((row, column), merged_range_size)
+            self.current_merged_anchors.add((merged_range.min_row, merged_range.min_col))
+
+    def __is_merged_cell(self, cell):
+        merged_range_size = self.current_merged_cells.get((cell.row, cell.column))
+        if merged_range_size is None:
+            return False
+        self.current_range = merged_range_size
+        return True
 
-    def __get_first_cells_of_merged_ranges(self):
-        return [merged_range.start_cell.coordinate for merged_range in self.current_sheet_ranges]
+    def __is_first_cell_of_merged_range(self, cell):
+        return (cell.row, cell.column) in self.current_merged_anchors
 
     def __get_merged_cell_data(self):
         try:
@@ -73,7 +203,7 @@ class ExcelParser:
                 cell_data["rowspan"] = self.current_range["rows"]
             return cell_data
         except:
-            print("Error getting merged cell data", sys.exc_info()[0])
+            self.__report_error("Error getting merged cell data")
             return {}
 
     def __get_cell_alignment(self, cell):
@@ -86,15 +216,15 @@ class ExcelParser:
                     alignment["vertical"] = cell.alignment.vertical
             return alignment
         except:
-            print("Error getting cell alignment", sys.exc_info()[0])
+            self.__report_error("Error getting cell alignment")
             return {}
     
     def __get_color_from_theme(self, color_data):
         try:
-            color = theme_and_tint_to_rgb(self.workbook, color_data.theme, color_data.tint)
+            color = self.theme_palette.theme_and_tint_to_rgb(color_data.theme, color_data.tint)
             return color
         except:
-            print("Error getting color from theme")
+            self.__report_error("Error getting color from theme")
             return {}
 
     def __get_color_data(self, color_data):
@@ -120,13 +250,13 @@ class ExcelParser:
                 color = self.__get_color_from_theme(color_data)
             return f"#{color}"
         except:
-            print("Error getting color data (" + str(color_data) + ")") 
+            self.__report_error("Error getting color data (" + str(color_data) + ")")
             return None
 
     def __get_cell_font_data(self, cell):
         try:
             cell_font_data = {}
-            default_font_data = self.__get_default_font_data()
+            default_font_data = self.current_default_font
             if cell.font:
                 if cell.font.name != default_font_data["font"]:
                     cell_font_data["font"] = cell.font.name
@@ -144,7 +274,7 @@ class ExcelParser:
                         cell_font_data["color"] = color
             return cell_font_data
         except:
-            print("Error getting cell font data")
+            self.__report_error("Error getting cell font data")
             return {}
 
     def __get_border_style(self, border_style):
@@ -157,36 +287,54 @@ class ExcelParser:
         else:
           return "single"
 
+    def __get_border_side_data(self, border_id, direction):
+        # [style, color] of one side of a border, resolved once per border id and side
+        border_key = (border_id, direction)
+        border_side = self.border_table.get(border_key)
+        if border_side is None:
+            self.metrics.count("border_cache_misses")
+            border_side = []
+            side = getattr(self.current_borders[border_id], direction)
+            if side and side.style and side.color:
+                border_side.append(self.__get_border_style(side.style))
+                border_side.append(self.__get_color_data(side.color))
+            self.border_table[border_key] = border_side
+        else:
+            self.metrics.count("border_cache_hits")
+        return border_side
+
+    def __get_border_id(self, cell):
+        return cell._style.borderId if cell._style else 0
+
+    def __get_neighbor_border_id(self, row_cells, column):
+        # cells that are not stored have the default border
+        neighbor = row_cells.get(column)
+        return self.__get_border_id(neighbor) if neighbor is not None else 0
+
     def __set_border(self, cell, direction_list):
         try:
-            border_top, border_right, border_bottom, border_left = [], [], [], []
-            border = cell.border
             direction = direction_list[0]
             partner = direction_list[1]
-            neighbor = None
 
-            if getattr(border, direction) and getattr(border, direction).style and getattr(border, direction).color:
-                locals()[f"border_{direction}"].append(self.__get_border_style(getattr(border, direction).style))
-                locals()[f"border_{direction}"].append(self.__get_color_data(getattr(border, direction).color))
-            else:
-                if cell.row == 1 and direction == "top":
-                    return False
-                if cell.column == 1 and direction == "left":
-                    return False
-                if direction == "top":
-                    neighbor = self.current_sheet.cell(row=cell.row-1, column=cell.column)
-                elif direction == "right":
-                    neighbor = self.current_sheet.cell(row=cell.row, column=cell.column+1)
-                elif direction == "bottom":
-                    neighbor = self.current_sheet.cell(row=cell.row+1, column=cell.column)
-                elif direction == "left":
-                    neighbor = self.current_sheet.cell(row=cell.row, column=cell.column-1)
-                if getattr(neighbor.border, partner) and getattr(neighbor.border, partner).style and getattr(neighbor.border, partner).color:
-                    locals()[f"border_{direction}"].append(self.__get_border_style(getattr(neighbor.border, partner).style))
-                    locals()[f"border_{direction}"].append(self.__get_color_data(getattr(neighbor.border, partner).color))
-            return locals()[f"border_{direction}"]
+            border_side = self.__get_border_side_data(self.__get_border_id(cell), direction)
+            if border_side:
+                return border_side
+
+            if cell.row == 1 and direction == "top":
+                return False
+            if cell.column == 1 and direction == "left":
+                return False
+            if direction == "top":
+                neighbor_border_id = self.__get_neighbor_border_id(self.previous_row_cells, cell.column)
+            elif direction == "right":
+                neighbor_border_id = self.__get_neighbor_border_id(self.current_row_cells, cell.column+1)
+            elif direction == "bottom":
+                neighbor_border_id = self.__get_neighbor_border_id(self.next_row_cells, cell.column)
+            elif direction == "left":
+                neighbor_border_id = self.__get_neighbor_border_id(self.current_row_cells, cell.column-1)
+            return self.__get_border_side_data(neighbor_border_id, partner)
         except:
-            print("Error setting border", sys.exc_info()[0])
+            self.__report_error("Error setting border")
             return []
 
     # def __set_merged_border(self, cell, direction):
@@ -288,7 +436,7 @@ class ExcelParser:
 
             return cell_border_data
         except:
-            print("Error getting cell border data (" + cell.coordinate + ")" + sys.exc_info()[0] + " " + str(sys.exc_info()[1]))
+            self.__report_error("Error getting cell border data (" + cell.coordinate + ")")
             return {}
 
     def __get_fill_color(self, cell):
@@ -300,9 +448,23 @@ class ExcelParser:
                         return color
             return None
         except:
-            print("Error getting cell fill color (" + str(cell.coordinate) + ")")
+            self.__report_error("Error getting cell fill color (" + str(cell.coordinate) + ")")
             return None
 
+    def __get_cell_style_data(self, cell):
+        # alignment, font and fill only depend on the cell's style ids and the sheet's default font,
+        # so they are resolved once per distinct combination and shared by every cell using it
+        style = cell._style or StyleArray()
+        style_key = (style.alignmentId, style.fontId, style.fillId, self.current_default_font_key)
+        style_data = self.style_table.get(style_key)
+        if style_data is None:
+            self.metrics.count("style_cache_misses")
+            style_data = (self.__get_cell_alignment(cell), self.__get_cell_font_data(cell), self.__get_fill_color(cell))
+            self.style_table[style_key] = style_data
+        else:
+            self.metrics.count("style_cache_hits")
+        return style_data
+
     def __map_cell_data(self, cell):
         try:
             cell_data = {
@@ -311,22 +473,18 @@ class ExcelParser:
             
             value = cell.value
             if value != None:
-                cell_data["value"] = cell.value.strftime("%Y/%m/%d") if cell.is_date else value
-                if cell._style[3] in [50, 51, 52, 53, 54, 55, 56, 57, 58, 59, 60]:
-                    dt = datetime.fromordinal(datetime(1900, 1, 1).toordinal() + cell_data["value"] - 2).strftime("%Y/%m/%d")
-                    cell_data["value"] = dt
+                cell_data["value"] = self.number_formats.get_formatter(cell)(value, cell.is_date)
 
-            is_merged_cell = self.__is_merged_cell(cell, self.current_sheet_ranges)
+            is_merged_cell = self.__is_merged_cell(cell)
             if is_merged_cell:
-                if cell.coordinate not in self.__get_first_cells_of_merged_ranges():
+                if not self.__is_first_cell_of_merged_range(cell):
                     return {}
                 cell_data.update(self.__get_merged_cell_data())
 
-            alignment = self.__get_cell_alignment(cell)
+            alignment, font, fill_color = self.__get_cell_style_data(cell)
             if alignment:
                 cell_data["alignment"] = alignment
             
-            font = self.__get_cell_font_data(cell)
             if font:
                 cell_data["font"] = font if font else None
 
@@ -334,7 +492,6 @@ class ExcelParser:
             if border:
                 cell_data["border"] = border
 
-            fill_color = self.__get_fill_color(cell)
             if fill_color:
                 cell_data["fill"] = {"color":fill_color}
 
@@ -343,71 +500,454 @@ class ExcelParser:
 
             return cell_data
         except:
-            print("Error getting cell data (" + cell.coordinate + ")")
-            print(sys.exc_info()[0])
+            self.__report_error("Error getting cell data (" + cell.coordinate + ")")
             return {}
 
-    def __cell_data_wrapper(self, cell):
-        cell_data = self.__map_cell_data(cell)
-        self.empty_columns = self.empty_columns + 1 if cell_data == {} else 0
-        return cell_data if cell_data else None
+    def __can_have_output(self, cell):
+        # a cell is only mapped to something when it has a value, a border or a fill
+        style = cell._style
+        return cell.value is not None or (style is not None and (style.borderId != 0 or style.fillId != 0))
+
+    def __get_row_columns(self):
+        # stored cells that can have output, and the cells around a border, which may show its other side
+        columns = set()
+        for column, cell in self.current_row_cells.items():
+            if self.__can_have_output(cell):
+                columns.add(column)
+            if self.__get_border_id(cell):
+                columns.update((column - 1, column + 1))
+        for row_cells in (self.previous_row_cells, self.next_row_cells):
+            columns.update(column for column, cell in row_cells.items() if self.__get_border_id(cell))
+        min_column, _, max_column, _ = self.current_bounds
+        return sorted(column for column in columns if min_column <= column <= max_column)
+
+    def __get_blank_cell(self, row, column):
+        # cells that are not stored are created for mapping only, the worksheet is left as it is
+        if isinstance(self.current_sheet, StreamingWorksheet):
+            return self.current_sheet.cell(row=row, column=column)
+        return Cell(self.current_sheet, row=row, column=column)
 
     def __get_row_data(self, row):
-        self.empty_columns = 0
         try:
             row_data = {
-                "linenumber": row[0].row
+                "linenumber": row
             }
 
-            columns = [self.__cell_data_wrapper(cell) for cell in row if self.empty_columns < 50 and cell.column < self.current_sheet.max_column+2]
+            columns = []
+            for column in self.__get_row_columns():
+                cell = self.current_row_cells.get(column)
+                columns.append(self.__map_cell_data(cell if cell is not None else self.__get_blank_cell(row, column)))
+            self.metrics.count("cells_visited", len(columns))
             columns = [column for column in columns if column]
+            self.metrics.count("cells_emitted", len(columns))
             if columns:
                 row_data["columns"] = columns
 
             return row_data
         except:
-            print("Error getting row data")
+            self.__report_error("Error getting row data")
             return {}
 
-    def __row_data_wrapper(self, row):
-        row_data = self.__get_row_data(row)
-        self.empty_rows = self.empty_rows + 1 if row_data.get('columns') is None or row_data == {} else 0
-        return row_data
+    def __iter_stored_rows(self, min_row, max_row, min_column, max_column):
+        # (row, {column: cell}) of the rows that have stored cells, in order. This pre-pass over the stored
+        # cells replaces walking every position of the sheet's extent
+        if isinstance(self.current_sheet, StreamingWorksheet):
+            yield from self.current_sheet.iter_stored_rows(min_row, max_row, min_column, max_column)
+            return
+        stored_cells = self.current_sheet._cells
+        row_columns = {}
+        for row, column in stored_cells:
+            if min_row <= row <= max_row and min_column <= column <= max_column:
+                row_columns.setdefault(row, []).append(column)
+        for row in sorted(row_columns):
+            yield row, dict((column, stored_cells[(row, column)]) for column in sorted(row_columns[row]))
+
+    def __iter_row_neighborhoods(self, stored_rows):
+        # (row, previous row cells, row cells, next row cells) of the rows that can have output: the
+        # stored rows and the rows right above and below them, which may show the other side of a border
+        previous, current, following = (0, {}), next(stored_rows, None), next(stored_rows, None)
+        last_row = 0
+        while current is not None:
+            loaded = dict(loaded_row for loaded_row in (previous, current, following) if loaded_row is not None)
+            for row in (current[0] - 1, current[0], current[0] + 1):
+                if row <= last_row or (row != current[0] and row in loaded):
+                    continue
+                yield row, loaded.get(row - 1, {}), loaded.get(row, {}), loaded.get(row + 1, {})
+                last_row = row
+            previous, current, following = current, following, next(stored_rows, None)
+
+    def __iter_row_data(self):
+        min_column, min_row, max_column, max_row = self.current_bounds
+        if min_column > max_column or min_row > max_row:
+            return
+        # rows and columns just outside a requested range are read for their borders but not mapped
+        stored_rows = self.__iter_stored_rows(max(min_row - 1, 1), max_row + 1, max(min_column - 1, 1), max_column + 1)
+        for row, self.previous_row_cells, self.current_row_cells, self.next_row_cells in self.__iter_row_neighborhoods(stored_rows):
+            if min_row <= row <= max_row:
+                row_data = self.__get_row_data(row)
+                if row_data.get('columns') is not None:
+                    yield row_data
 
     def __map_row_data(self):
-        self.empty_rows = 0
         try:
-            rows =  [self.__row_data_wrapper(row) for row in self.current_sheet.iter_rows() if self.empty_rows < 50 and row[0].row < self.current_sheet.max_row+2]
-            return [row for row in rows if row.get('columns') is not None]
+            return list(self.__iter_row_data())
         except:
-            print("Error getting rows")
+            self.__report_error("Error getting rows")
             return []
 
-    def __map_sheet_data(self, sheet, index):
+    def __get_sheet_header(self, sheet, index):
         try:
             self.current_sheet = sheet
             self.current_sheet_number = index + 1
             self.current_sheet_ranges = self.current_sheet.merged_cells.ranges if self.current_sheet.merged_cells else []
+            self.__index_merged_cells()
+            self.current_borders = sheet.parent._borders
+            self.current_default_font = self.__get_default_font_data()
+            self.current_default_font_key = tuple(self.current_default_font.items())
+            self.current_bounds = self.__get_sheet_bounds()
 
             return {
                 "sheetnumber": self.current_sheet_number,
                 "sheetname": sheet.title,
-                "font": self.__get_default_font_data(),
-                "lines": self.__map_row_data()
+                "font": self.current_default_font
             }
         except:
-            print("Error mapping sheet data", sys.exc_info()[0])
+            self.__report_error("Error mapping sheet data")
             return {}
 
-    def parse_xlsx_to_json_file(self, excel_path):
+    def __map_sheet_data(self, sheet, index):
+        with self.metrics.phase("sheet " + str(index + 1)):
+            sheet_data = self.__get_sheet_header(sheet, index)
+            if sheet_data:
+                with self.metrics.phase("rows"):
+                    sheet_data["lines"] = self.__map_row_data()
+        return sheet_data
+
+    def __prepare_workbook(self, excel_path, engine, sheets=None, cell_range=None, values="raw"):
+        self.excel_path = excel_path
+        self.selected_sheets = sheets
+        self.cell_range = cell_range
+        self.value_format = values
+        self.current_sheets = None
+        self.cached_sheets = {}
+        # index -> JSON of the sheets read from or written to the sheet cache, reused by the verbose output
+        self.sheet_json = {}
+        self.sheet_fingerprints = None
+        if cell_range is not None:
+            # an invalid range fails the whole request instead of every sheet
+            range_boundaries(cell_range)
+        # so is an unknown value format
+        NumberFormats(values)
+        if engine not in ["openpyxl", "stream"]:
+            raise ValueError("Unknown engine: " + str(engine))
+        # every step below reads the workbook's parts from this one spooled archive
+        with self.metrics.phase("spool"):
+            self.archive = WorkbookArchive(excel_path)
+        try:
+            if self.sheet_cache is not None:
+                with self.metrics.phase("fingerprint"):
+                    self.__load_cached_sheets()
+            with self.metrics.phase("open"):
+                if engine == "openpyxl":
+                    self.__open_workbook()
+                else:
+                    self.__open_streaming_workbook()
+                if self.current_sheets is None:
+                    worksheets = self.workbook.worksheets
+                    self.current_sheets = [(index, worksheets[index]) for index in self.__select_sheets([sheet.title for sheet in worksheets])]
+                # cached sheets keep their place among the mapped ones, they may not have been loaded at all
+                mapped_indices = set(index for index, _ in self.current_sheets)
+                self.current_sheets += [(index, None) for index in self.cached_sheets if index not in mapped_indices]
+                self.current_sheets.sort(key=lambda current_sheet: current_sheet[0])
+            self.number_formats = NumberFormats(values, self.__get_openpyxl_workbook().epoch)
+            self.__setup_styles()
+        except:
+            self.__close_workbook()
+            raise
+
+    def __get_style_key(self):
+        # styles and theme decide what every style id of the stylesheet resolves to. Borders added
+        # for merged ranges come after the stylesheet's own ones and are not shared
+        try:
+            styles_xml = self.archive.read(ARC_STYLE)
+            theme_xml = self.archive.read(ARC_THEME) if ARC_THEME in self.archive.NameToInfo else b""
+            borders = [child for child in self.archive.get_tree(ARC_STYLE) if child.tag.endswith('borders')]
+            border_count = len(borders[0]) if borders else 0
+            return hashlib.sha256(styles_xml + b"\0" + theme_xml).hexdigest(), border_count
+        except:
+            self.__report_error("Error getting style key")
+            return None, 0
+
+    def __get_openpyxl_workbook(self):
+        return self.workbook.wb if isinstance(self.workbook, StreamingWorkbook) else self.workbook
+
+    def __setup_styles(self):
+        style_key, border_count = None, 0
+        if self.style_cache is not None:
+            with self.metrics.phase("style-setup"):
+                style_key, border_count = self.__get_style_key()
+                cached_styles = self.style_cache.get(style_key) if style_key else None
+            if cached_styles is not None:
+                self.metrics.count("style_set_hits")
+                self.custom_index, self.theme_palette, self.style_table, border_table = cached_styles
+                self.border_table = dict(border_table)
+                return
+        with self.metrics.phase("custom-index"):
+            self.__check_for_custom_index()
+        with self.metrics.phase("style-setup"):
+            self.style_table = {}
+            self.border_table = {}
+            self.__load_theme_palette()
+            if style_key:
+                self.metrics.count("style_set_misses")
+                self.current_borders = self.__get_openpyxl_workbook()._borders
+                for border_id in range(min(border_count, len(self.current_borders))):
+                    for direction in ["top", "right", "bottom", "left"]:
+                        self.__get_border_side_data(border_id, direction)
+                self.style_cache[style_key] = (self.custom_index, self.theme_palette, self.style_table, dict(self.border_table))
+
+    def __load_cached_sheets(self):
+        try:
+            sheet_fingerprints = get_sheet_fingerprints(self.archive, {"cell_range": self.cell_range, "values": self.value_format})
+        except:
+            self.__report_error("Error getting sheet fingerprints")
+            return None
+        self.sheet_fingerprints = [fingerprint for _, fingerprint in sheet_fingerprints]
+        for index in self.__select_sheets([title for title, _ in sheet_fingerprints]):
+            cached_json, _ = self.sheet_cache.get(self.sheet_fingerprints[index])
+            if cached_json is None:
+                self.metrics.count("sheet_cache_misses")
+            else:
+                self.metrics.count("sheet_cache_hits")
+                self.cached_sheets[index] = json.loads(cached_json)
+                self.sheet_json[index] = cached_json
+
+    def __cache_sheet_data(self, index, sheet_data):
+        if self.sheet_fingerprints is not None and sheet_data:
+            self.__cache_sheet_json(index, json.dumps(sheet_data, ensure_ascii=False))
+
+    def __cache_sheet_json(self, index, sheet_json):
+        self.sheet_cache.set(self.sheet_fingerprints[index], sheet_json)
+        self.sheet_json[index] = sheet_json
+
+    def __get_sheet_data(self, sheet, index):
+        if index in self.cached_sheets:
+            return self.cached_sheets[index]
+        sheet_data = self.__map_sheet_data(sheet, index)
+        self.__cache_sheet_data(index, sheet_data)
+        return sheet_data
+
+    def __iter_sheet_lines(self, sheet_data, index):
+        if self.sheet_fingerprints is None:
+            yield from self.__iter_row_data()
+            return
+        # the lines are kept serialized, and only while the sheet fits in the memory tier of the sheet cache,
+        # so a large sheet is streamed without being held in memory
+        line_jsons = []
+        sheet_size = 0
+        for line in self.__iter_row_data():
+            if line_jsons is not None:
+                line_json = json.dumps(line, ensure_ascii=False)
+                sheet_size += len(line_json) + 2
+                if sheet_size > self.sheet_cache.max_bytes:
+                    self.metrics.count("sheet_cache_skipped")
+                    line_jsons = None
+                else:
+                    line_jsons.append(line_json)
+            yield line
+        if line_jsons is not None:
+            # the text json.dumps gives for dict(sheet_data, lines=lines)
+            self.__cache_sheet_json(index, json.dumps(sheet_data, ensure_ascii=False)[:-1] + ', "lines": [' + ", ".join(line_jsons) + "]}")
+
+    def __close_workbook(self):
+        if isinstance(self.workbook, StreamingWorkbook):
+            self.workbook.close()
+        if self.archive is not None:
+            self.archive.release()
+            self.archive = None
+
+    def iter_xlsx_sheets(self, excel_path, engine="openpyxl", sheets=None, cell_range=None, values="raw"):
+        """Yields (sheet header, lines) for each sheet, where lines is a generator of the sheet's rows.
+        The parser is not reentrant: lines must be consumed before moving on to the next sheet."""
+        self.__prepare_workbook(excel_path, engine, sheets, cell_range, values)
+        try:
+            for index, sheet in self.current_sheets:
+                if index in self.cached_sheets:
+                    sheet_data = dict(self.cached_sheets[index])
+                    yield sheet_data, iter(sheet_data.pop("lines"))
+                    continue
+                sheet_data = self.__get_sheet_header(sheet, index)
+                yield sheet_data, self.__iter_sheet_lines(sheet_data, index) if sheet_data else iter(())
+        finally:
+            self.__close_workbook()
+
+    def __get_style_table(self, output_format):
+        # the verbose format repeats the styles on every cell, the compact one refers to a shared table
+        if output_format == "verbose":
+            return None
+        if output_format == "compact":
+            return StyleTable()
+        raise ValueError("Unknown output format: " + str(output_format))
+
+    def iter_xlsx_to_json(self, excel_path, engine="openpyxl", sheets=None, cell_range=None, output_format="verbose", values="raw"):
+        """Yields the JSON document of parse_xlsx_to_json_file in chunks, one sheet header or row at a time.
+        Once the first chunk is out an error can no longer be reported, so a sheet whose rows fail
+        half way keeps the rows already sent. The style table of the compact format comes last."""
+        try:
+            style_table = self.__get_style_table(output_format)
+            sheet_iterator = self.iter_xlsx_sheets(excel_path, engine, sheets, cell_range, values)
+            sheet = next(sheet_iterator, None)
+        except Exception as e:
+            self.__report_error("Error parsing workbook")
+            yield json.dumps({"error": str(e)}, ensure_ascii=False)
+            return
+
+        # closing the generator, when a client goes away, releases the workbook right away
         try:
-            self.excel_path = excel_path
-            self.__open_workbook(excel_path)
-            self.__check_for_custom_index(excel_path)
+            if style_table is None:
+                separators = (", ", ": ")
+                yield '{"sheets": ['
+            else:
+                separators = (",", ":")
+                yield '{"format":"compact","sheets":['
+            item_separator, key_separator = separators
+            separator = ""
+            while sheet is not None:
+                sheet_data, lines = sheet
+                if sheet_data:
+                    yield separator + json.dumps(sheet_data, ensure_ascii=False, separators=separators)[:-1] + item_separator + '"lines"' + key_separator + "["
+                    try:
+                        line_separator = ""
+                        for line in lines:
+                            if style_table is not None:
+                                line = compact_line(line, style_table)
+                            yield line_separator + json.dumps(line, ensure_ascii=False, separators=separators)
+                            line_separator = item_separator
+                    except Exception:
+                        self.__report_error("Error getting rows")
+                    yield "]}"
+                else:
+                    yield separator + "{}"
+                separator = item_separator
+                sheet = next(sheet_iterator, None)
+            if style_table is None:
+                yield "]}"
+            else:
+                yield '],"styles":' + json.dumps(style_table.styles, ensure_ascii=False, separators=separators) + "}"
+        finally:
+            sheet_iterator.close()
 
-            sheet_data = [self.__map_sheet_data(sheet, index) for index, sheet in enumerate(self.workbook.worksheets)]
+    def iter_xlsx_to_html(self, excel_path, engine="openpyxl", sheets=None, cell_range=None, values="formatted"):
+        """Yields an HTML page with a table per sheet in chunks, one row at a time, see libs.html_renderer.
+        Errors are handled like in iter_xlsx_to_json, an error before the first chunk gives a page with the error."""
+        try:
+            sheet_iterator = self.iter_xlsx_sheets(excel_path, engine, sheets, cell_range, values)
+            sheet = next(sheet_iterator, None)
+        except Exception as e:
+            self.__report_error("Error parsing workbook")
+            yield get_error_page(str(e))
+            return
 
-            return json.dumps({"sheets": sheet_data}, ensure_ascii=False)
+        # the cells of every sheet share one set of style classes
+        style_table = StyleTable()
+        first_column = (range_boundaries(cell_range)[0] or 1) if cell_range else 1
+        try:
+            yield PAGE_START
+            while sheet is not None:
+                sheet_data, lines = sheet
+                if sheet_data:
+                    table_writer = SheetTableWriter(sheet_data, style_table, first_column)
+                    yield table_writer.get_start()
+                    try:
+                        for line in lines:
+                            yield table_writer.get_row(line)
+                    except Exception:
+                        self.__report_error("Error getting rows")
+                    yield table_writer.get_end()
+                sheet = next(sheet_iterator, None)
+            yield PAGE_END
+        finally:
+            sheet_iterator.close()
+
+    def __get_shared_tables(self):
+        # workbook level data computed once here and shipped to every sheet worker
+        self.current_borders = self.workbook.wb._borders
+        for border_id in range(len(self.current_borders)):
+            for direction in ["top", "right", "bottom", "left"]:
+                self.__get_border_side_data(border_id, direction)
+        return {
+            "custom_index": self.custom_index,
+            "theme_palette": self.theme_palette,
+            "border_table": self.border_table,
+            "cell_range": self.cell_range,
+            "values": self.value_format
+        }
+
+    def open_for_sheet_worker(self, excel_path, shared_tables):
+        self.excel_path = excel_path
+        self.archive = WorkbookArchive(excel_path)
+        self.__open_streaming_workbook()
+        self.custom_index = shared_tables["custom_index"]
+        self.theme_palette = shared_tables["theme_palette"]
+        self.border_table = shared_tables["border_table"]
+        self.cell_range = shared_tables["cell_range"]
+        self.value_format = shared_tables["values"]
+        self.number_formats = NumberFormats(self.value_format, self.workbook.wb.epoch)
+        self.style_table = {}
+
+    def map_sheet_data(self, index):
+        return self.__map_sheet_data(self.workbook.worksheets[index], index)
+
+    def __map_sheets_in_pool(self, excel_path, processes, sheets, cell_range, values):
+        # workers read their sheets with the streaming engine, which only parses the sheets they map.
+        # they open the archive's spooled copy of an upload by name
+        self.__prepare_workbook(excel_path, "stream", sheets, cell_range, values)
+        try:
+            selected_indices = [index for index, _ in self.current_sheets]
+            sheet_indices = [index for index in selected_indices if index not in self.cached_sheets]
+            shared_tables = self.__get_shared_tables()
+            if not sheet_indices:
+                return [self.cached_sheets[index] for index in selected_indices], selected_indices
+            with self.metrics.phase("sheets"):
+                with ProcessPoolExecutor(max_workers=min(processes, len(sheet_indices)), mp_context=pool_context,
+                                         initializer=init_sheet_worker, initargs=(self.archive.get_path(), shared_tables)) as executor:
+                    sheet_results = list(executor.map(map_sheet_in_worker, sheet_indices))
+        finally:
+            self.__close_workbook()
+        mapped_sheets = {}
+        for index, (sheet_data, counters) in zip(sheet_indices, sheet_results):
+            self.metrics.merge_counters(counters)
+            self.__cache_sheet_data(index, sheet_data)
+            mapped_sheets[index] = sheet_data
+        return [self.cached_sheets[index] if index in self.cached_sheets else mapped_sheets[index] for index in selected_indices], selected_indices
+
+    def __dump_sheets(self, sheet_data, style_table, sheet_indices):
+        with self.metrics.phase("serialize"):
+            if style_table is None:
+                # sheets already serialized for the sheet cache are not serialized again
+                sheet_jsons = [self.sheet_json.get(index) or json.dumps(sheet, ensure_ascii=False) for sheet, index in zip(sheet_data, sheet_indices)]
+                return '{"sheets": [' + ", ".join(sheet_jsons) + "]}"
+            sheet_data = compact_sheets(sheet_data, style_table)
+            return json.dumps({"format": "compact", "sheets": sheet_data, "styles": style_table.styles}, ensure_ascii=False, separators=(",", ":"))
+
+    def parse_xlsx_to_json_file(self, excel_path, engine="openpyxl", processes=None, sheets=None, cell_range=None, output_format="verbose", values="raw"):
+        """Maps the workbook to JSON. sheets limits it to some sheets, by name or sheet number,
+        and cell_range to an A1-style range ("B2:F40", "A:C", "3:10") of each of them.
+        output_format is "verbose" or "compact", see libs.compact_format.
+        values is "raw" or "formatted" for the text Excel shows, see libs.number_format."""
+        try:
+            style_table = self.__get_style_table(output_format)
+            if processes and processes > 1:
+                sheet_data, sheet_indices = self.__map_sheets_in_pool(excel_path, processes, sheets, cell_range, values)
+                return self.__dump_sheets(sheet_data, style_table, sheet_indices)
+
+            self.__prepare_workbook(excel_path, engine, sheets, cell_range, values)
+            try:
+                sheet_data = [self.__get_sheet_data(sheet, index) for index, sheet in self.current_sheets]
+            finally:
+                self.__close_workbook()
+
+            return self.__dump_sheets(sheet_data, style_table, [index for index, _ in self.current_sheets])
         except Exception as e:
-            print(e)
+            self.__report_error("Error parsing workbook")
             return json.dumps({"error": str(e)}, ensure_ascii=False)
@@ -0,0 +1,152 @@
+import html
+
+from openpyxl.utils.cell import column_index_from_string
+
+# HTML rendering of the mapped rows, one table per sheet, written row by row so a browser paints the
+# rows as they arrive. Every distinct cell style becomes one CSS class (.s0, .s1, ...), whose rule is
+# written in a <style> element right before the first row using it. Merged cells keep their colspan
+# and rowspan, and the empty cells between mapped ones are filled in so the columns line up.
+
+PAGE_START = ('<!DOCTYPE html><html><head><meta charset="utf-8"><style>'
+              'table{border-collapse:collapse;margin-bottom:2em}td,th{padding:1px 4px;white-space:pre-wrap}'
+              'th{color:#888;font-weight:normal;text-align:right}</style></head><body>')
+PAGE_END = "</body></html>"
+
+BORDER_STYLES = {
+    "single": "1px solid",
+    "thick": "2px solid",
+    "extrathick": "3px solid",
+    "double": "3px double"
+}
+VERTICAL_ALIGNMENTS = {"top": "top", "center": "middle", "bottom": "bottom"}
+
+
+def get_css_string(text):
+    # font names come from the workbook: anything able to end the string, the rule or the <style>
+    # element is written as a CSS escape, the space ends the escape
+    return '"%s"' % "".join("\\%X " % ord(char) if char in '"\\<>&' or ord(char) < 0x20 or ord(char) == 0x7F else char
+                             for char in text)
+
+
+def get_border_css(property_name, side):
+    color = side.get("color") or "#000000"
+    return "%s:%s %s" % (property_name, BORDER_STYLES.get(side.get("style"), "1px solid"), color)
+
+
+def get_style_css(style):
+    """Returns the CSS declarations of a style of the style table"""
+    declarations = []
+    font = style.get("font", {})
+    if "font" in font:
+        declarations.append("font-family:" + get_css_string(font["font"]))
+    if "size" in font:
+        declarations.append("font-size:%dpx" % font["size"])
+    if font.get("style") == "bold":
+        declarations.append("font-weight:bold")
+    if "color" in font:
+        declarations.append("color:" + font["color"])
+    decorations = []
+    if font.get("underline") in ["single", "singleAccounting"]:
+        decorations.append("underline")
+    elif font.get("underline") in ["double", "doubleAccounting"]:
+        decorations.append("underline double")
+    if font.get("strikethrough"):
+        decorations.append("line-through")
+    if decorations:
+        declarations.append("text-decoration:" + " ".join(decorations))
+    border = style.get("border", {})
+    if "outline" in border:
+        declarations.append(get_border_css("border", border["outline"]))
+    for direction in ["top", "right", "bottom", "left"]:
+        if direction in border:
+            declarations.append(get_border_css("border-" + direction, border[direction]))
+    if style.get("fill", {}).get("color"):
+        declarations.append("background-color:" + style["fill"]["color"])
+    alignment = style.get("alignment", {})
+    if "horizontal" in alignment:
+        declarations.append("text-align:" + alignment["horizontal"])
+    if "vertical" in alignment:
+        declarations.append("vertical-align:" + VERTICAL_ALIGNMENTS[alignment["vertical"]])
+    return ";".join(declarations)
+
+
+def get_value_html(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    return html.escape(str(value))
+
+
+class SheetTableWriter:
+    """Writes the rows of one sheet as a table, with the classes of style_table, a StyleTable shared by
+    the sheets of the page. Rows only covered by a rowspan are written empty,
+    other rows without a mapped line are left out like in the JSON output"""
+
+    def __init__(self, sheet_data, style_table, first_column=1):
+        self.style_table = style_table
+        self.first_column = first_column
+        self.last_row = 0
+        # column -> last row of the merged cell covering it from a row above
+        self.spanned_columns = {}
+        font = sheet_data.get("font", {})
+        self.table_style = ";".join(declaration for declaration in [
+            "font-family:" + get_css_string(font["font"]) if font.get("font") else None,
+            "font-size:%dpx" % font["size"] if font.get("size") else None
+        ] if declaration)
+        self.title = "#%s - %s" % (sheet_data.get("sheetnumber"), sheet_data.get("sheetname"))
+
+    def get_start(self):
+        table_style = ' style="%s"' % html.escape(self.table_style) if self.table_style else ""
+        return "<h1>%s</h1><table%s><tbody>" % (html.escape(self.title), table_style)
+
+    def get_end(self):
+        # merged cells reaching below the last line still need their rows
+        last_spanned_row = max(self.spanned_columns.values(), default=0)
+        return self.__get_spanned_rows(last_spanned_row + 1) + "</tbody></table>"
+
+    def __is_spanned(self, row, column):
+        return self.spanned_columns.get(column, 0) >= row
+
+    def __get_spanned_rows(self, row):
+        # rows between the previous line and this one that a rowspan reaches into
+        last_spanned_row = max(self.spanned_columns.values(), default=0)
+        return "".join("<tr><th>%d</th></tr>" % spanned_row for spanned_row in range(self.last_row + 1, min(row, last_spanned_row + 1)))
+
+    def get_row(self, line):
+        """Returns the HTML of a mapped line, preceded by the rules of the styles it uses first"""
+        row = line["linenumber"]
+        style_count = len(self.style_table.styles)
+        parts = [self.__get_spanned_rows(row), "<tr><th>%d</th>" % row]
+        position = self.first_column
+        for cell_data in line.get("columns", []):
+            column = column_index_from_string(cell_data["colnumber"])
+            while position < column:
+                if not self.__is_spanned(row, position):
+                    parts.append("<td></td>")
+                position += 1
+            attributes = ""
+            style = self.style_table.get_index(cell_data)
+            if style is not None:
+                attributes += ' class="s%d"' % style
+            colspan, rowspan = cell_data.get("colspan", 1), cell_data.get("rowspan", 1)
+            if colspan > 1:
+                attributes += ' colspan="%d"' % colspan
+            if rowspan > 1:
+                attributes += ' rowspan="%d"' % rowspan
+                for spanned_column in range(column, column + colspan):
+                    self.spanned_columns[spanned_column] = row + rowspan - 1
+            parts.append("<td%s>%s</td>" % (attributes, get_value_html(cell_data.get("value"))))
+            position = max(position, column + colspan)
+        parts.append("</tr>")
+        self.last_row = row
+        # a <style> may stand between the rows of a table body and applies to the whole page
+        new_styles = self.style_table.styles[style_count:]
+        if new_styles:
+            rules = "".join(".s%d{%s}" % (style_count + index, get_style_css(style)) for index, style in enumerate(new_styles))
+            parts.insert(0, "<style>" + rules + "</style>")
+        return "".join(parts)
+
+
+def get_error_page(message):
+    return PAGE_START + '<p class="error">' + html.escape(message) + "</p>" + PAGE_END
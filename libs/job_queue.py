@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from libs.result_cache import write_file_atomically
+
+# Background jobs run on a bounded pool of threads of the process that accepted them.
+# Jobs are kept until a TTL after they finish. With a directory, their states and results are also
+# written there, so any worker of the host can answer for a job another worker ran.
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Bounded queue of jobs whose function returns the job's result as a string"""
+
+    def __init__(self, max_workers=2, max_pending=16, ttl=600, directory=None):
+        # max_pending counts the queued and the running jobs
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.directory = directory
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = {}
+        self.results = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def submit(self, function, *args):
+        """Queues function(*args) and returns the job id, raises JobQueueFull when max_pending jobs are pending"""
+        self.__remove_expired()
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise JobQueueFull("Too many pending jobs")
+            self.pending += 1
+            job = self.__add_job("queued")
+        self.__write_state(job)
+        self.executor.submit(self.__run, job["job"], function, args)
+        return job["job"]
+
+    def add_result(self, result):
+        """Adds a job that is already done, for results known without running anything"""
+        self.__remove_expired()
+        with self.lock:
+            job = self.__add_job("done")
+            job["finished"] = job["submitted"]
+            self.results[job["job"]] = result
+        self.__write_result(job["job"], result)
+        self.__write_state(job)
+        return job["job"]
+
+    def get_state(self, job_id):
+        """Returns the state of the job (status, times, error), None when it is unknown or expired"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return None if self.__is_expired(job, time.time()) else dict(job)
+        return self.__read_state(job_id)
+
+    def get_result(self, job_id):
+        """Returns (state, result), result is None until the job is done"""
+        state = self.get_state(job_id)
+        if state is None or state["status"] != "done":
+            return state, None
+        with self.lock:
+            result = self.results.get(job_id)
+        if result is None:
+            result = self.__read_result(job_id)
+        return state, result
+
+    def __add_job(self, status):
+        job = {"job": uuid.uuid4().hex, "status": status, "submitted": time.time()}
+        self.jobs[job["job"]] = job
+        return job
+
+    def __run(self, job_id, function, args):
+        self.__update(job_id, status="running", started=time.time())
+        try:
+            result = function(*args)
+            with self.lock:
+                self.results[job_id] = result
+            self.__write_result(job_id, result)
+            self.__update(job_id, status="done", finished=time.time())
+        except Exception as e:
+            logger.warning("Job %s failed: %r", job_id, e)
+            self.__update(job_id, status="failed", finished=time.time(), error=str(e))
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def __update(self, job_id, **changes):
+        with self.lock:
+            job = self.jobs[job_id]
+            job.update(changes)
+            job = dict(job)
+        self.__write_state(job)
+
+    def __is_expired(self, job, now):
+        return "finished" in job and job["finished"] + self.ttl < now
+
+    def __remove_expired(self):
+        now = time.time()
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items() if self.__is_expired(job, now)]:
+                del self.jobs[job_id]
+                self.results.pop(job_id, None)
+        if not self.directory:
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".state.json"):
+                job_id = name[:-len(".state.json")]
+                state = self.__read_state(job_id, include_expired=True)
+                if state is not None and self.__is_expired(state, now):
+                    self.__remove_files(job_id)
+
+    def __get_path(self, job_id, suffix):
+        # job ids come from urls, anything but an id never reaches the file system
+        if not self.directory or not re.fullmatch("[0-9a-f]{32}", job_id):
+            return None
+        return os.path.join(self.directory, job_id + suffix)
+
+    def __write_state(self, job):
+        path = self.__get_path(job["job"], ".state.json")
+        if path is None:
+            return
+        try:
+            write_file_atomically(self.directory, path, json.dumps(job))
+        except OSError:
+            logger.warning("Error writing job state file %s", job["job"])
+
+    def __write_result(self, job_id, result):
+        path = self.__get_path(job_id, ".result.json")
+        if path is None:
+            return
+        try:
+            write_file_atomically(self.directory, path, result)
+        except OSError:
+            logger.warning("Error writing job result file %s", job_id)
+
+    def __read_state(self, job_id, include_expired=False):
+        path = self.__get_path(job_id, ".state.json")
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as job_file:
+                state = json.load(job_file)
+        except (OSError, ValueError):
+            return None
+        if not include_expired and self.__is_expired(state, time.time()):
+            return None
+        return state
+
+    def __read_result(self, job_id):
+        path = self.__get_path(job_id, ".result.json")
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as job_file:
+                return job_file.read()
+        except OSError:
+            return None
+
+    def __remove_files(self, job_id):
+        for suffix in [".state.json", ".result.json"]:
+            try:
+                os.remove(self.__get_path(job_id, suffix))
+            except OSError:
+                pass
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Phase timings and counters of one parse, and the totals of every parse served by this process.
+
+
+class ParseMetrics:
+    """Timings (seconds, in the order the phases first ran) and counters of a single parse"""
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start_time)
+
+    def add_timing(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def merge_counters(self, counters):
+        for name, amount in counters.items():
+            self.counters[name] += amount
+
+    def get_server_timing(self):
+        """Value of a Server-Timing header, durations in milliseconds"""
+        return ", ".join("%s;dur=%.1f" % (name.replace(" ", "-"), seconds * 1000) for name, seconds in self.timings.items())
+
+
+class MetricsRegistry:
+    """Totals of all parses of the process, for the metrics endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.timings = defaultdict(lambda: {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+        self.counters = defaultdict(int)
+
+    def record(self, metrics):
+        with self.lock:
+            self.requests += 1
+            for name, seconds in metrics.timings.items():
+                # sheets are reported together, their names are not useful across requests
+                name = "sheet" if name.startswith("sheet ") else name
+                timing = self.timings[name]
+                timing["count"] += 1
+                timing["seconds"] += seconds
+                timing["max_seconds"] = max(timing["max_seconds"], seconds)
+            for name, amount in metrics.counters.items():
+                self.counters[name] += amount
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "timings": dict((name, dict(timing)) for name, timing in self.timings.items()),
+                "counters": dict(self.counters)
+            }
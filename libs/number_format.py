@@ -0,0 +1,492 @@
+import math
+import re
+from datetime import date, datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from fractions import Fraction
+
+from openpyxl.utils.datetime import CALENDAR_WINDOWS_1900, from_excel, to_excel
+
+# Cell values rendered through their number format. Each format id is compiled once into a function
+# of (value, is_date), so mapping a cell only costs a dictionary lookup and a call.
+#   "raw": the values as they have always been written: numbers as numbers, dates as yyyy/mm/dd and
+#          the serial numbers of the CJK date formats 50 to 60 as dates
+#   "formatted": the text Excel shows, e.g. "12.5%", "$1,234.00", "Mar 5, 2021", "1 1/4"
+# Colors are ignored and conditions only pick the section, as in Excel.
+
+VALUE_FORMATS = ["raw", "formatted"]
+
+# CJK date formats that openpyxl does not know, written as dates in both modes
+CJK_DATE_FORMAT_IDS = range(50, 61)
+CJK_DATE_FORMAT = "yyyy/mm/dd"
+
+# the accounting formats of ECMA-376, used instead of openpyxl's BUILTIN_FORMATS, whose id 44 lacks
+# the semicolons between its sections
+ACCOUNTING_FORMATS = {
+    37: '#,##0 ;(#,##0)',
+    38: '#,##0 ;[Red](#,##0)',
+    39: '#,##0.00;(#,##0.00)',
+    40: '#,##0.00;[Red](#,##0.00)',
+    41: '_(* #,##0_);_(* \\(#,##0\\);_(* "-"_);_(@_)',
+    42: '_("$"* #,##0_);_("$"* \\(#,##0\\);_("$"* "-"_);_(@_)',
+    43: '_(* #,##0.00_);_(* \\(#,##0.00\\);_(* "-"??_);_(@_)',
+    44: '_("$"* #,##0.00_);_("$"* \\(#,##0.00\\);_("$"* "-"??_);_(@_)'
+}
+
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July", "August", "September",
+               "October", "November", "December"]
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+TOKEN_PATTERN = re.compile(r'''
+    "(?P<quoted>[^"]*)"
+  | \\(?P<escaped>.)
+  | _(?P<padding>.)
+  | \*(?P<fill>.)
+  | \[(?P<bracket>[^\]]*)\]
+  | (?P<general>General)
+  | (?P<ampm>AM/PM|A/P)
+  | (?P<exponent>E[+-])
+  | (?P<date>yyyy|yyy|yy|y|e|mmmmm|mmmm|mmm|mm|m|dddd|ddd|dd|d|hh|h|ss|s)
+  | (?P<digit>[0#?])
+  | (?P<symbol>[.,%/@])
+  | (?P<literal>.)
+''', re.VERBOSE | re.IGNORECASE | re.DOTALL)
+
+CONDITION_PATTERN = re.compile(r"^(<=|>=|<>|<|>|=)\s*(-?[0-9.]+)$")
+ELAPSED_PATTERN = re.compile(r"^(h+|m+|s+)$", re.IGNORECASE)
+
+CONDITIONS = {
+    "<": lambda value, limit: value < limit,
+    ">": lambda value, limit: value > limit,
+    "=": lambda value, limit: value == limit,
+    "<=": lambda value, limit: value <= limit,
+    ">=": lambda value, limit: value >= limit,
+    "<>": lambda value, limit: value != limit
+}
+
+
+def split_sections(format_code):
+    """Splits a format code on the semicolons that are not quoted or escaped"""
+    sections, current, quoted, escaped = [], "", False, False
+    for character in format_code:
+        if escaped:
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        elif character == '"':
+            quoted = not quoted
+        elif character == ";" and not quoted:
+            sections.append(current)
+            current = ""
+            continue
+        current += character
+    sections.append(current)
+    return sections
+
+
+def format_general(value):
+    # Excel shows at most 11 characters of a number in the General format
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e11:
+            return str(int(value))
+        text = "%.10G" % value if abs(value) < 1e11 and abs(value) >= 1e-9 else "%.5E" % value
+        if "E" in text:
+            mantissa, exponent = text.split("E")
+            if "." in mantissa:
+                mantissa = mantissa.rstrip("0").rstrip(".")
+            return "%sE%s%02d" % (mantissa, "-" if exponent.startswith("-") else "+", abs(int(exponent)))
+        return text.rstrip("0").rstrip(".") if "." in text else text
+    return str(value)
+
+
+def round_half_up(number, decimals):
+    # Excel rounds halves away from zero, "%f" would round 2.5 to 2. Formatted with "f" as str() writes 0E-10 for zero
+    return format(Decimal(repr(number)).quantize(Decimal(1).scaleb(-decimals), rounding=ROUND_HALF_UP), "f")
+
+
+def group_thousands(digits):
+    return "{:,}".format(int(digits)) if digits else digits
+
+
+class Section:
+    """One section of a number format: its tokens and what they need to render a value"""
+
+    def __init__(self, text):
+        self.tokens = []
+        self.condition = None
+        self.is_date = False
+        self.has_text = False
+        self.is_general = False
+        for match in TOKEN_PATTERN.finditer(text):
+            kind, token = match.lastgroup, match.group(match.lastgroup)
+            if kind == "quoted" or kind == "escaped":
+                self.tokens.append(("literal", token))
+            elif kind == "padding":
+                self.tokens.append(("literal", " "))
+            elif kind == "fill":
+                continue
+            elif kind == "bracket":
+                self.__add_bracket(token)
+            elif kind == "general":
+                self.is_general = True
+                self.tokens.append(("general", token))
+            elif kind == "ampm":
+                self.is_date = True
+                self.tokens.append(("ampm", token))
+            elif kind == "date":
+                self.is_date = True
+                self.tokens.append(("date", token.lower()))
+            elif kind == "symbol" and token == "@":
+                self.has_text = True
+                self.tokens.append(("text", token))
+            else:
+                self.tokens.append((kind, token))
+        if self.is_date:
+            self.__prepare_date()
+        else:
+            self.__prepare_number()
+
+    def __add_bracket(self, content):
+        condition = CONDITION_PATTERN.match(content)
+        if condition:
+            self.condition = (CONDITIONS[condition.group(1)], float(condition.group(2)))
+        elif ELAPSED_PATTERN.match(content):
+            self.is_date = True
+            self.tokens.append(("elapsed", content[0].lower()))
+        elif content.startswith("$"):
+            # locale and currency: [$€-407] shows the symbol, [$-409] nothing
+            symbol = content[1:].split("-")[0]
+            if symbol:
+                self.tokens.append(("literal", symbol))
+        # anything else is a color
+
+    def matches(self, value):
+        return self.condition is not None and self.condition[0](value, self.condition[1])
+
+    def __prepare_date(self):
+        date_tokens = [index for index, token in enumerate(self.tokens) if token[0] in ["date", "elapsed"]]
+        self.twelve_hours = any(token[0] == "ampm" for token in self.tokens)
+        self.minute_tokens = set()
+        # m and mm are minutes right after an hour or right before a second
+        for position, index in enumerate(date_tokens):
+            if self.tokens[index][1] not in ["m", "mm"]:
+                continue
+            previous_token = self.tokens[date_tokens[position - 1]][1] if position > 0 else None
+            next_token = self.tokens[date_tokens[position + 1]][1] if position + 1 < len(date_tokens) else None
+            if previous_token in ["h", "hh"] or next_token in ["s", "ss"]:
+                self.minute_tokens.add(index)
+        # decimals after the seconds, as in ss.000
+        self.second_decimals = 0
+        for index, token in enumerate(self.tokens):
+            if token == ("symbol", ".") and index > 0 and self.tokens[index - 1][0] in ["date", "elapsed"]:
+                self.second_decimals = len(list(self.__iter_zero_digits(index + 1)))
+
+    def __iter_zero_digits(self, index):
+        while index < len(self.tokens) and self.tokens[index] == ("digit", "0"):
+            yield index
+            index += 1
+
+    def __prepare_number(self):
+        digit_indices = [index for index, token in enumerate(self.tokens) if token[0] == "digit"]
+        self.percent = sum(1 for token in self.tokens if token == ("symbol", "%"))
+        self.exponent = next((index for index, token in enumerate(self.tokens) if token[0] == "exponent"), None)
+        slash = next((index for index, token in enumerate(self.tokens) if token == ("symbol", "/")), None)
+        self.fraction = slash if slash is not None and digit_indices and digit_indices[0] < slash else None
+        point = next((index for index, token in enumerate(self.tokens) if token == ("symbol", ".")), None)
+        end = self.exponent if self.exponent is not None else len(self.tokens)
+        if point is None or point > end:
+            point = None
+        last_integer = point if point is not None else end
+        self.integer_digits = [index for index in digit_indices if index < last_integer]
+        self.decimal_digits = [index for index in digit_indices if point is not None and point < index < end]
+        self.exponent_digits = [index for index in digit_indices if self.exponent is not None and index > self.exponent]
+        self.point = point
+        # commas between integer digits group thousands, commas right after the last digit divide by 1000
+        self.thousands = False
+        self.scale = 0
+        for index, token in enumerate(self.tokens):
+            if token != ("symbol", ","):
+                continue
+            if self.integer_digits and self.integer_digits[0] < index < self.integer_digits[-1]:
+                self.thousands = True
+            elif digit_indices and index > digit_indices[-1 if point is None else 0] and (point is None or index < point or index > (self.decimal_digits or [point])[-1]):
+                self.scale += 1
+
+    def render(self, value, epoch, automatic_sign):
+        if self.is_date:
+            return self.__render_date(value, epoch)
+        if self.fraction is not None:
+            return self.__render_fraction(value, automatic_sign)
+        return self.__render_number(value, automatic_sign)
+
+    def render_text(self, text):
+        return "".join(text if kind == "text" else token for kind, token in self.tokens if kind in ["text", "literal"])
+
+    def __render_literals(self, index):
+        kind, token = self.tokens[index]
+        if kind == "general":
+            return None
+        if kind == "symbol" and token in [",", "%"]:
+            return "%" if token == "%" else ""
+        return token if kind in ["literal", "symbol"] else ""
+
+    def __render_number(self, value, automatic_sign):
+        number = abs(value) * (100 ** self.percent) / (1000 ** self.scale)
+        exponent = 0
+        if self.exponent is not None and number:
+            # the exponent is a multiple of the integer digits, 1 in 0.00E+00 and 3 in ##0.0E+0
+            step = max(len(self.integer_digits), 1)
+            exponent = int(math.floor(math.log10(number) / step) * step) if step > 1 else int(math.floor(math.log10(number)))
+            number = number / (10 ** exponent)
+        rounded = round_half_up(number, len(self.decimal_digits))
+        integer_text, _, decimal_text = rounded.partition(".")
+        if self.exponent is not None and len(integer_text) > max(len(self.integer_digits), 1):
+            exponent += 1
+            rounded = round_half_up(number / 10, len(self.decimal_digits))
+            integer_text, _, decimal_text = rounded.partition(".")
+        if integer_text == "0":
+            integer_text = ""
+        negative = value < 0 and automatic_sign and (rounded.strip("0.") != "")
+
+        digits = {}
+        # integer digits are filled from the right, the first placeholder takes any extra digits
+        remaining = integer_text
+        for position, index in enumerate(reversed(self.integer_digits)):
+            placeholder = self.tokens[index][1]
+            if position == len(self.integer_digits) - 1:
+                digit, remaining = remaining, ""
+            else:
+                digit, remaining = remaining[-1:], remaining[:-1]
+            if not digit:
+                digit = "0" if placeholder == "0" else " " if placeholder == "?" else ""
+            digits[index] = digit
+        if self.thousands and self.integer_digits:
+            grouped = group_thousands("".join(digits[index] for index in self.integer_digits).strip())
+            for index in self.integer_digits:
+                digits[index] = ""
+            digits[self.integer_digits[0]] = grouped
+        # decimal digits lose their trailing zeros where the placeholder is # or ?
+        trailing = True
+        for index, digit in reversed(list(zip(self.decimal_digits, decimal_text))):
+            placeholder = self.tokens[index][1]
+            if trailing and digit == "0" and placeholder != "0":
+                digit = " " if placeholder == "?" else ""
+            else:
+                trailing = False
+            digits[index] = digit
+        exponent_text = str(abs(exponent)).zfill(len(self.exponent_digits))
+        for index in self.exponent_digits:
+            digits[index] = ""
+        if self.exponent_digits:
+            digits[self.exponent_digits[0]] = exponent_text
+
+        parts = []
+        for index, (kind, token) in enumerate(self.tokens):
+            if index == self.point and not self.integer_digits:
+                # without integer placeholders, as in .00, the integer part still shows before the point
+                parts.append(integer_text)
+            if kind == "digit":
+                parts.append(digits.get(index, ""))
+            elif kind == "exponent":
+                parts.append("E" + ("-" if exponent < 0 else "+" if token.endswith("+") else ""))
+            elif kind == "general":
+                parts.append(format_general(abs(value)))
+            else:
+                parts.append(self.__render_literals(index) or "")
+        text = "".join(parts)
+        return "-" + text if negative else text
+
+    def __render_fraction(self, value, automatic_sign):
+        # "# ?/?": whole number, then numerator over denominator. Without a whole part the numerator takes it
+        slash = self.fraction
+        numerator_digits = []
+        index = slash - 1
+        while index >= 0 and self.tokens[index][0] == "digit":
+            numerator_digits.insert(0, index)
+            index -= 1
+        whole_digits = [index for index, token in enumerate(self.tokens) if token[0] == "digit" and index < (numerator_digits or [slash])[0]]
+        denominator_tokens = []
+        index = slash + 1
+        while index < len(self.tokens) and (self.tokens[index][0] == "digit" or (self.tokens[index][0] == "literal" and self.tokens[index][1].isdigit())):
+            denominator_tokens.append(index)
+            index += 1
+        fixed_denominator = "".join(self.tokens[index][1] for index in denominator_tokens)
+        number = abs(value)
+        whole = int(number) if whole_digits else 0
+        remainder = number - whole
+        if fixed_denominator.isdigit():
+            denominator = int(fixed_denominator)
+            numerator = int(round(remainder * denominator))
+        else:
+            fraction = Fraction(remainder).limit_denominator(10 ** max(len(denominator_tokens), 1) - 1)
+            numerator, denominator = fraction.numerator, fraction.denominator
+        if whole_digits and numerator == denominator:
+            whole, numerator = whole + 1, 0
+
+        width = len(numerator_digits) + 1 + max(len(denominator_tokens), len(str(denominator)))
+        if numerator == 0 and whole_digits:
+            fraction_text = " " * width
+        else:
+            fraction_text = str(numerator).rjust(len(numerator_digits)) + "/" + str(denominator).ljust(len(denominator_tokens))
+        whole_text = str(whole) if whole or not whole_digits or numerator == 0 else ""
+        if whole_digits and not whole_text:
+            whole_text = " " * len(whole_digits) if self.tokens[whole_digits[-1]][1] == "?" else ""
+
+        parts = []
+        fraction_start = (numerator_digits or [slash])[0]
+        fraction_end = (denominator_tokens or [slash])[-1]
+        for index, (kind, token) in enumerate(self.tokens):
+            if whole_digits and index == whole_digits[0]:
+                parts.append(whole_text)
+            elif index == fraction_start:
+                parts.append(fraction_text)
+            elif kind == "digit" or fraction_start < index <= fraction_end:
+                continue
+            elif whole_digits and whole_digits[0] < index < fraction_start and not whole_text and numerator:
+                continue
+            else:
+                parts.append(self.__render_literals(index) or "")
+        text = "".join(parts)
+        return "-" + text if value < 0 and automatic_sign and (whole or numerator) else text
+
+    def is_text_only(self):
+        # a section like @ or "x"@ shows text, numbers falling on it are shown as General
+        return self.has_text and not self.is_date and not any(kind in ["digit", "general"] for kind, _ in self.tokens)
+
+    def __render_date(self, value, epoch):
+        if value < 0:
+            return "#" * 11
+        seconds = round(value * 86400, self.second_decimals)
+        days = int(seconds // 86400)
+        day_seconds = seconds - days * 86400
+        moment = from_excel(days, epoch) if days > 0 else epoch + timedelta(days=days)
+        if isinstance(moment, time):
+            moment = epoch
+        hour, minute = int(day_seconds // 3600), int(day_seconds % 3600 // 60)
+        second = day_seconds % 60
+
+        parts = []
+        for index, (kind, token) in enumerate(self.tokens):
+            if kind == "date":
+                parts.append(self.__render_date_token(index, token, moment, hour, minute, second))
+            elif kind == "elapsed":
+                total = seconds / {"h": 3600, "m": 60, "s": 1}[token]
+                parts.append(str(int(total)).zfill(2 if token != "h" else 1))
+            elif kind == "ampm":
+                suffix = "AM" if hour < 12 else "PM"
+                parts.append(suffix if len(token) > 3 else suffix[0])
+            elif kind == "digit":
+                continue
+            elif kind == "symbol" and token == "." and self.second_decimals:
+                fraction = ("%.*f" % (self.second_decimals, second % 1))[1:]
+                parts.append(fraction)
+            elif kind == "symbol":
+                parts.append(token)
+            else:
+                parts.append(self.__render_literals(index) or "")
+        return "".join(parts)
+
+    def __render_date_token(self, index, token, moment, hour, minute, second):
+        if index in self.minute_tokens:
+            return str(minute).zfill(len(token))
+        if token in ["yyyy", "yyy", "e"]:
+            return str(moment.year)
+        if token in ["yy", "y"]:
+            return str(moment.year % 100).zfill(2)
+        if token == "mmmmm":
+            return MONTH_NAMES[moment.month - 1][0]
+        if token == "mmmm":
+            return MONTH_NAMES[moment.month - 1]
+        if token == "mmm":
+            return MONTH_NAMES[moment.month - 1][:3]
+        if token in ["mm", "m"]:
+            return str(moment.month).zfill(len(token))
+        if token == "dddd":
+            return DAY_NAMES[moment.weekday()]
+        if token == "ddd":
+            return DAY_NAMES[moment.weekday()][:3]
+        if token in ["dd", "d"]:
+            return str(moment.day).zfill(len(token))
+        if token in ["hh", "h"]:
+            shown_hour = (hour % 12 or 12) if self.twelve_hours else hour
+            return str(shown_hour).zfill(len(token))
+        if token in ["ss", "s"]:
+            return str(int(second)).zfill(len(token))
+        return token
+
+
+def compile_number_format(format_code, epoch=CALENDAR_WINDOWS_1900):
+    """Returns a function rendering a value like Excel does with format_code"""
+    if not format_code or format_code.lower() == "general":
+        return lambda value, is_date: format_general(value)
+    sections = [Section(text) for text in split_sections(format_code)]
+    number_sections = sections[:3]
+    text_section = sections[3] if len(sections) > 3 else next((section for section in sections[:1] if section.has_text), None)
+    conditional = any(section.condition is not None for section in number_sections)
+
+    def format_value(value, is_date):
+        if isinstance(value, bool):
+            return "TRUE" if value else "FALSE"
+        if isinstance(value, (datetime, date, time, timedelta)):
+            value = to_excel(value, epoch)
+        if not isinstance(value, (int, float)):
+            return text_section.render_text(str(value)) if text_section is not None else str(value)
+        if conditional:
+            section = next((section for section in number_sections if section.matches(value)), None)
+            if section is None:
+                section = next((section for section in number_sections if section.condition is None), number_sections[-1])
+            automatic_sign = True
+        elif len(number_sections) == 1 or value > 0 or (value == 0 and len(number_sections) == 2):
+            section, automatic_sign = number_sections[0], len(number_sections) == 1
+        elif value < 0:
+            section, automatic_sign = number_sections[1], False
+        else:
+            section, automatic_sign = number_sections[2], False
+        if section.is_text_only():
+            return format_general(value)
+        return section.render(value, epoch, automatic_sign)
+
+    return format_value
+
+
+def compile_raw_format(number_format_id):
+    """Returns the function writing values the way they have always been written"""
+    def format_raw(value, is_date):
+        return value.strftime("%Y/%m/%d") if is_date else value
+    if number_format_id not in CJK_DATE_FORMAT_IDS:
+        return format_raw
+
+    def format_cjk_date(value, is_date):
+        value = format_raw(value, is_date)
+        return datetime.fromordinal(datetime(1900, 1, 1).toordinal() + value - 2).strftime("%Y/%m/%d")
+    return format_cjk_date
+
+
+class NumberFormats:
+    """Formatting functions of one workbook's number formats, compiled on first use and kept by format id"""
+
+    def __init__(self, value_format="raw", epoch=CALENDAR_WINDOWS_1900):
+        if value_format not in VALUE_FORMATS:
+            raise ValueError("Unknown value format: " + str(value_format))
+        self.value_format = value_format
+        self.epoch = epoch
+        self.formatters = {}
+
+    def get_formatter(self, cell):
+        style = cell._style
+        number_format_id = style.numFmtId if style is not None else 0
+        formatter = self.formatters.get(number_format_id)
+        if formatter is None:
+            formatter = self.__compile(number_format_id, cell)
+            self.formatters[number_format_id] = formatter
+        return formatter
+
+    def __compile(self, number_format_id, cell):
+        if self.value_format == "raw":
+            return compile_raw_format(number_format_id)
+        if number_format_id in CJK_DATE_FORMAT_IDS:
+            return compile_number_format(CJK_DATE_FORMAT, self.epoch)
+        if number_format_id in ACCOUNTING_FORMATS:
+            return compile_number_format(ACCOUNTING_FORMATS[number_format_id], self.epoch)
+        return compile_number_format(cell.number_format if number_format_id else "General", self.epoch)
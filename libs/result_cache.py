@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Parse results keyed by the sha256 of the uploaded workbook plus the parser options.
+# A bounded in-process LRU sits in front of an optional directory shared by every worker on the host.
+# The helpers writing and evicting files of such shared directories are used by the job queue and the row store too.
+
+logger = logging.getLogger(__name__)
+
+
+def write_file_atomically(directory, path, content):
+    """Writes content to path through a temporary file of directory, so other workers never read a partial file"""
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as target_file:
+            target_file.write(content)
+        os.replace(temporary_path, path)
+    except OSError:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        raise
+
+
+def evict_least_recent(entries, max_bytes, keep=None):
+    """Removes the least recent of the (recency, size, path) entries of a shared directory, files or directories,
+    until their total size is at most max_bytes. The entry at path keep, the one just written, is never removed"""
+    total_size = sum(entry[1] for entry in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        if path == keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total_size -= size
+
+
+def get_cache_key(excel_file, options):
+    """Hashes the uploaded bytes and the parser options, leaving the file at its start"""
+    digest = hashlib.sha256()
+    excel_file.seek(0)
+    for chunk in iter(lambda: excel_file.read(1024 * 1024), b""):
+        digest.update(chunk)
+    excel_file.seek(0)
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Size bounded LRU cache of serialized results, with an optional on-disk tier"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, max_disk_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key):
+        """Returns (result, tier) where tier is "memory", "disk" or None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry[0], "memory"
+        result = self.__read_from_disk(key)
+        if result is not None:
+            self.__store_in_memory(key, result)
+            return result, "disk"
+        return None, None
+
+    def set(self, key, result):
+        self.__store_in_memory(key, result)
+        self.__write_to_disk(key, result)
+
+    def __store_in_memory(self, key, result):
+        result_size = len(result.encode("utf-8"))
+        if result_size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (result, result_size)
+            self.size += result_size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted[1]
+
+    def __get_path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def __read_from_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self.__get_path(key), encoding="utf-8") as cached_file:
+                result = cached_file.read()
+            # the modification time is the recency used for eviction
+            os.utime(self.__get_path(key))
+            return result
+        except OSError:
+            return None
+
+    def __write_to_disk(self, key, result):
+        if not self.directory:
+            return
+        try:
+            write_file_atomically(self.directory, self.__get_path(key), result)
+            self.__evict_from_disk()
+        except OSError:
+            logger.warning("Error writing result cache file %s", key)
+
+    def __evict_from_disk(self):
+        cached_files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            cached_files.append((stat.st_mtime, stat.st_size, os.path.join(self.directory, name)))
+        evict_least_recent(cached_files, self.max_disk_bytes)
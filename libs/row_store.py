@@ -0,0 +1,137 @@
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+
+from libs.result_cache import evict_least_recent
+
+# Mapped rows of parsed workbooks kept on disk, so a viewer can fetch any window of a sheet without
+# parsing the workbook again. Each document is a directory named after its key, holding:
+#   sheets.json       the sheet headers, with the number and the first and last linenumber of their lines
+#   sheet<N>.jsonl    the lines of sheet N, one JSON row per line in linenumber order
+#   sheet<N>.index    one fixed size (linenumber, offset) record per line, searched by bisection
+# A window is two binary searches in the index and one read of the lines between the two offsets, whatever
+# the size of the sheet. Documents are written to a temporary directory and renamed into place, so readers
+# never see a partial one. The least recently used documents go once the store is above max_bytes.
+
+INDEX_RECORD = struct.Struct("<QQ")
+
+
+def find_record(index, record_count, linenumber):
+    # position of the first record whose linenumber is at least linenumber
+    low, high = 0, record_count
+    while low < high:
+        middle = (low + high) // 2
+        if INDEX_RECORD.unpack_from(index, middle * INDEX_RECORD.size)[0] < linenumber:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class RowStore:
+    """On-disk store of the lines of parsed workbooks, read a window of rows at a time"""
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __get_path(self, key, name=None):
+        # keys come from urls, anything but a hash never reaches the file system
+        if not re.fullmatch("[0-9a-f]{64}", key):
+            return None
+        path = os.path.join(self.directory, key)
+        return os.path.join(path, name) if name else path
+
+    def get_sheets(self, key):
+        """Returns the sheet headers of a stored document, None when it is not stored"""
+        path = self.__get_path(key, "sheets.json")
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as sheets_file:
+                sheets = json.load(sheets_file)
+            # the modification time is the recency used for eviction
+            os.utime(path)
+            return sheets
+        except (OSError, ValueError):
+            return None
+
+    def write(self, key, sheets):
+        """Stores the (sheet header, lines) of ExcelParser.iter_xlsx_sheets under key and returns the headers"""
+        directory = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            headers = [self.__write_sheet(directory, sheet_data, lines) for sheet_data, lines in sheets]
+            with open(os.path.join(directory, "sheets.json"), "w", encoding="utf-8") as sheets_file:
+                json.dump(headers, sheets_file, ensure_ascii=False)
+            try:
+                os.rename(directory, self.__get_path(key))
+            except OSError:
+                # another worker stored the same document first
+                shutil.rmtree(directory, ignore_errors=True)
+        except:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        # a document larger than max_bytes on its own is still kept until the next one is written
+        self.__evict(self.__get_path(key))
+        return headers
+
+    def __write_sheet(self, directory, sheet_data, lines):
+        if not sheet_data:
+            return {}
+        name = "sheet%d" % sheet_data["sheetnumber"]
+        line_count, first_line, last_line, offset = 0, None, None, 0
+        with open(os.path.join(directory, name + ".jsonl"), "wb") as lines_file, \
+                open(os.path.join(directory, name + ".index"), "wb") as index_file:
+            for line in lines:
+                line_json = json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n"
+                lines_file.write(line_json)
+                index_file.write(INDEX_RECORD.pack(line["linenumber"], offset))
+                offset += len(line_json)
+                line_count += 1
+                first_line = line["linenumber"] if first_line is None else first_line
+                last_line = line["linenumber"]
+        return dict(sheet_data, linecount=line_count, firstline=first_line, lastline=last_line)
+
+    def get_lines_json(self, key, sheet_number, start, count):
+        """Returns the JSON array of the lines of rows start to start + count - 1 of a sheet,
+        None when the document or the sheet is not stored"""
+        path = self.__get_path(key, "sheet%d" % sheet_number)
+        if path is None:
+            return None
+        try:
+            with open(path + ".index", "rb") as index_file, open(path + ".jsonl", "rb") as lines_file:
+                record_count = os.fstat(index_file.fileno()).st_size // INDEX_RECORD.size
+                if record_count == 0:
+                    return "[]"
+                with mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                    first = find_record(index, record_count, start)
+                    end = find_record(index, record_count, start + count)
+                    if first == end:
+                        return "[]"
+                    first_offset = INDEX_RECORD.unpack_from(index, first * INDEX_RECORD.size)[1]
+                    end_offset = INDEX_RECORD.unpack_from(index, end * INDEX_RECORD.size)[1] if end < record_count else None
+                lines_file.seek(first_offset)
+                data = lines_file.read(end_offset - first_offset) if end_offset is not None else lines_file.read()
+        except OSError:
+            return None
+        # newlines within the rows are escaped by json.dumps, every one left separates two rows
+        return "[" + b",".join(data.rstrip(b"\n").split(b"\n")).decode("utf-8") + "]"
+
+    def __evict(self, keep):
+        documents = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith("."):
+                continue
+            try:
+                recency = os.stat(os.path.join(path, "sheets.json")).st_mtime
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+            except OSError:
+                continue
+            documents.append((recency, size, path))
+        evict_least_recent(documents, self.max_bytes, keep)
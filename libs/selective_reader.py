@@ -0,0 +1,50 @@
+from openpyxl.styles.stylesheet import apply_stylesheet
+
+from libs.workbook_archive import ArchiveExcelReader
+
+# openpyxl's full load, restricted to some of the worksheets: the others are never parsed into cells.
+
+
+class SelectiveExcelReader(ArchiveExcelReader):
+    """ExcelReader that only reads the worksheets picked by select_sheets
+
+    select_sheets receives the titles of the workbook's worksheets and returns the (0 based)
+    indices to read. They are kept in sheet_indices, in the order of the loaded worksheets.
+    """
+
+    def __init__(self, archive, select_sheets, data_only=True):
+        super().__init__(archive, data_only=data_only)
+        self.select_sheets = select_sheets
+        self.sheet_indices = []
+
+    def read_worksheets(self):
+        # chartsheets and sheets without a part are not worksheets, like in Workbook.worksheets
+        worksheets = [(sheet, rel) for sheet, rel in self.parser.find_sheets()
+                      if rel.target in self.valid_files and "chartsheet" not in rel.Type]
+        self.sheet_indices = sorted(self.select_sheets([sheet.name for sheet, _ in worksheets]))
+        selected = [worksheets[index] for index in self.sheet_indices]
+        find_sheets = self.parser.find_sheets
+        self.parser.find_sheets = lambda: iter(selected)
+        try:
+            super().read_worksheets()
+        finally:
+            self.parser.find_sheets = find_sheets
+
+    def read(self):
+        # same steps as ExcelReader.read without binding print titles and areas, whose
+        # sheet positions do not hold once sheets are skipped
+        self.read_manifest()
+        self.read_strings()
+        self.read_workbook()
+        self.read_properties()
+        self.read_theme()
+        apply_stylesheet(self.archive, self.wb)
+        self.read_worksheets()
+        self.archive.close()
+
+
+def load_selected_workbook(archive, select_sheets):
+    """Returns the workbook of a WorkbookArchive with only the selected worksheets loaded, and their indices in the full workbook"""
+    reader = SelectiveExcelReader(archive, select_sheets)
+    reader.read()
+    return reader.wb, reader.sheet_indices
@@ -0,0 +1,101 @@
+import hashlib
+import io
+import json
+
+from openpyxl.packaging.manifest import Manifest
+from openpyxl.reader.excel import _find_workbook_part
+from openpyxl.reader.strings import read_string_table
+from openpyxl.reader.workbook import WorkbookParser
+from openpyxl.xml.constants import ARC_CONTENT_TYPES, ARC_STYLE, ARC_THEME, SHARED_STRINGS, SHEET_MAIN_NS
+from openpyxl.xml.functions import iterparse
+
+# Fingerprints of the worksheets of an archive, taken from the raw parts without loading the workbook.
+# A sheet's output only depends on its own XML part, its position and title, the shared strings it refers to,
+# the parts every sheet refers to (styles with the custom indexed colors, theme), the date epoch and the parser options.
+# Excel rewrites the shared strings whenever text changes in any sheet, so only the strings a sheet uses count.
+# The archive is the parse's WorkbookArchive, whose cached parts the workbook readers use afterwards.
+
+
+def update_with_part(digest, archive, part_name, read_whole=False):
+    # parts the workbook readers read whole anyway are read through the archive's part cache
+    digest.update(part_name.encode("utf-8") if part_name else b"")
+    if part_name in archive.NameToInfo and read_whole:
+        digest.update(archive.read(part_name))
+    elif part_name in archive.NameToInfo:
+        with archive.open(part_name) as part:
+            for chunk in iter(lambda: part.read(1024 * 1024), b""):
+                digest.update(chunk)
+    digest.update(b"\0")
+
+
+CELL_TAG = "{%s}c" % SHEET_MAIN_NS
+VALUE_TAG = "{%s}v" % SHEET_MAIN_NS
+ROW_TAG = "{%s}row" % SHEET_MAIN_NS
+
+
+class DigestReader:
+    """File wrapper adding what is read from it to a digest"""
+
+    def __init__(self, source, digest):
+        self.source = source
+        self.digest = digest
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.digest.update(data)
+        return data
+
+
+def update_with_sheet_part(digest, archive, part_name, shared_strings):
+    # the sheet part is hashed while it is parsed for the indices of the shared strings its cells use
+    digest.update(part_name.encode("utf-8"))
+    string_indices = set()
+    with archive.open(part_name) as part:
+        for _, element in iterparse(DigestReader(part, digest)):
+            if element.tag == CELL_TAG:
+                if element.get("t") == "s":
+                    value = element.find(VALUE_TAG)
+                    if value is not None and value.text:
+                        string_indices.add(value.text)
+                element.clear()
+            elif element.tag == ROW_TAG:
+                element.clear()
+    digest.update(b"\0")
+    used_strings = []
+    for string_index in sorted(string_indices):
+        try:
+            used_strings.append([string_index, shared_strings[int(string_index)]])
+        except (ValueError, IndexError):
+            used_strings.append([string_index, None])
+    digest.update(json.dumps(used_strings, ensure_ascii=False).encode("utf-8"))
+
+
+def get_sheet_fingerprints(archive, options):
+    """Returns (title, fingerprint) for each worksheet of a WorkbookArchive, in the order of the workbook's worksheets"""
+    package = Manifest.from_tree(archive.get_tree(ARC_CONTENT_TYPES))
+    parser = WorkbookParser(archive, _find_workbook_part(package).PartName[1:])
+    parser.parse()
+
+    shared_digest = hashlib.sha256(json.dumps([options, str(parser.wb.epoch)], sort_keys=True).encode("utf-8"))
+    shared_strings_part = package.find(SHARED_STRINGS)
+    shared_strings = []
+    if shared_strings_part and shared_strings_part.PartName[1:] in archive.NameToInfo:
+        # read through the archive's part cache, the workbook readers read the same table afterwards
+        shared_strings = read_string_table(io.BytesIO(archive.read(shared_strings_part.PartName[1:])))
+    update_with_part(shared_digest, archive, ARC_STYLE, read_whole=True)
+    update_with_part(shared_digest, archive, ARC_THEME, read_whole=True)
+
+    sheet_fingerprints = []
+    # chartsheets and sheets without a part are skipped, like in Workbook.worksheets
+    for sheet, rel in parser.find_sheets():
+        if rel.target not in archive.NameToInfo or "chartsheet" in rel.Type:
+            continue
+        digest = shared_digest.copy()
+        digest.update(json.dumps([len(sheet_fingerprints), sheet.name]).encode("utf-8"))
+        # without shared strings there are no indices to collect and the part is only hashed
+        if shared_strings:
+            update_with_sheet_part(digest, archive, rel.target, shared_strings)
+        else:
+            update_with_part(digest, archive, rel.target)
+        sheet_fingerprints.append((sheet.name, digest.hexdigest()))
+    return sheet_fingerprints
@@ -0,0 +1,227 @@
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.styles.borders import Border
+from openpyxl.worksheet._reader import WorkSheetParser
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from openpyxl.cell.cell import Cell, MergedCell
+
+from libs.workbook_archive import ArchiveExcelReader
+
+# Reads worksheets straight from the xlsx archive, one row at a time, instead of building every
+# Cell of the workbook in memory like openpyxl.load_workbook does.
+# The cells handed out are regular openpyxl cells, with the same styles and merged-range borders
+# openpyxl would give them, so ExcelParser maps them exactly like cells of a fully loaded workbook.
+
+MERGED_BORDER_SIDES = ['top', 'left', 'right', 'bottom']
+
+
+class StreamingWorkbook:
+    """Workbook level parts (shared strings, styles, theme) and the list of streaming worksheets"""
+
+    def __init__(self, archive):
+        # archive is a WorkbookArchive, the worksheets stream from it until it is released
+        self.reader = ArchiveExcelReader(archive, read_only=True, data_only=True)
+        self.reader.read_manifest()
+        self.reader.read_strings()
+        self.reader.read_workbook()
+        self.reader.read_theme()
+        apply_stylesheet(self.reader.archive, self.reader.wb)
+        self.reader.read_worksheets()
+
+        self.wb = self.reader.wb
+        self.loaded_theme = self.wb.loaded_theme
+        self.worksheets = [StreamingWorksheet(self, ws) for ws in self.wb.worksheets]
+
+    def close(self):
+        self.reader.archive.close()
+
+
+class StreamingWorksheet:
+    """Worksheet that yields its rows while iterparsing the sheet xml, without keeping them"""
+
+    def __init__(self, workbook, read_only_worksheet):
+        # cells look up their styles through parent.parent, exactly like cells of a loaded worksheet
+        self.parent = workbook.wb
+        self.title = read_only_worksheet.title
+        self.source = read_only_worksheet
+        self.shared_strings = workbook.reader.shared_strings
+        self.known_styles = {}
+        self.merged_borders = {}
+        self.scanned = False
+
+    # the first pass only runs once the sheet is actually used, so opening a workbook does not parse every sheet
+    @property
+    def max_row(self):
+        self.__scan()
+        return self._max_row
+
+    @property
+    def max_column(self):
+        self.__scan()
+        return self._max_column
+
+    @property
+    def merged_cells(self):
+        self.__scan()
+        return self._merged_cells
+
+    def __get_parser(self, source):
+        return WorkSheetParser(source, self.shared_strings, data_only=True,
+                               epoch=self.parent.epoch,
+                               date_formats=self.parent._date_formats,
+                               timedelta_formats=self.parent._timedelta_formats)
+
+    def __scan(self):
+        # first pass: extent of the sheet, merged ranges (stored after sheetData) and the style of A1
+        if self.scanned:
+            return
+        self.scanned = True
+        max_row, max_column = 1, 1
+        with self.source._get_source() as source:
+            parser = self.__get_parser(source)
+            for _, cells in parser.parse():
+                for cell in cells:
+                    max_row = max(max_row, cell['row'])
+                    max_column = max(max_column, cell['column'])
+                    if cell['row'] == 1 and cell['column'] == 1:
+                        self.known_styles[(1, 1)] = cell['style_id']
+            merged_cells = parser.merged_cells
+
+        ranges = [CellRange(merge_cell.ref) for merge_cell in merged_cells.mergeCell] if merged_cells else []
+        for merged_range in ranges:
+            max_row = max(max_row, merged_range.max_row)
+            max_column = max(max_column, merged_range.max_col)
+        self._max_row = max_row
+        self._max_column = max_column
+        self._merged_cells = MultiCellRange(ranges)
+
+        if ranges:
+            self.__scan_merged_corners(ranges)
+            self.__resolve_merged_borders(ranges)
+        self.__index_merged_rows()
+
+    def __scan_merged_corners(self, ranges):
+        # second pass, only for sheets with merged ranges: the styles of the corner cells openpyxl
+        # uses to recreate the borders of a merged range
+        corners = set()
+        for merged_range in ranges:
+            corners.add((merged_range.min_row, merged_range.min_col))
+            corners.add((merged_range.max_row, merged_range.max_col))
+        corner_rows = set(row for row, _ in corners)
+        with self.source._get_source() as source:
+            for row, cells in self.__get_parser(source).parse():
+                if row not in corner_rows:
+                    continue
+                for cell in cells:
+                    coordinate = (cell['row'], cell['column'])
+                    if coordinate in corners:
+                        self.known_styles[coordinate] = cell['style_id']
+
+    def __get_known_border(self, coordinate):
+        style_id = self.known_styles.get(coordinate, 0)
+        return self.parent._borders[self.parent._cell_styles[style_id].borderId]
+
+    def __resolve_merged_borders(self, ranges):
+        # same steps as openpyxl's MergedCellRange._get_borders and format(): the top left cell takes
+        # the right and bottom borders of the bottom right cell, then its sides are copied to the edges
+        for merged_range in ranges:
+            start = (merged_range.min_row, merged_range.min_col)
+            end = (merged_range.max_row, merged_range.max_col)
+            start_border = self.__get_known_border(start)
+            if end in self.known_styles or end == start:
+                end_border = self.__get_known_border(end)
+                start_border = start_border + Border(right=end_border.right, bottom=end_border.bottom)
+
+            edge_borders = []
+            for name in MERGED_BORDER_SIDES:
+                side = getattr(start_border, name)
+                if side and side.style is None:
+                    continue
+                border = Border(**{name: side})
+                edge_borders.append((name, border))
+                if start in getattr(merged_range, name):
+                    start_border = start_border + border
+            self.merged_borders[start] = (merged_range, start_border, edge_borders)
+
+    def __index_merged_rows(self):
+        self.merged_rows = {}
+        for start, merged_data in self.merged_borders.items():
+            merged_range = merged_data[0]
+            for row in range(merged_range.min_row, merged_range.max_row + 1):
+                self.merged_rows.setdefault(row, []).append(start)
+
+    def __get_merged_data(self, row, column):
+        for start in self.merged_rows.get(row, ()):
+            merged_range = self.merged_borders[start][0]
+            if merged_range.min_col <= column <= merged_range.max_col:
+                return start, self.merged_borders[start]
+        return None, None
+
+    def __bind_cell(self, row, column, style_id=None, value=None, data_type='n'):
+        start, merged_data = self.__get_merged_data(row, column)
+        if start is not None and start != (row, column):
+            # every cell of a merged range but the top left one is replaced by a MergedCell
+            cell = MergedCell(self, row=row, column=column)
+            border = None
+            for name, edge_border in merged_data[2]:
+                if (row, column) in getattr(merged_data[0], name):
+                    if border is None:
+                        border = cell.border
+                    border = border + edge_border
+            if border is not None:
+                cell.border = border
+            return cell
+
+        style = self.parent._cell_styles[style_id] if style_id is not None else None
+        cell = Cell(self, row=row, column=column, style_array=style)
+        cell._value = value
+        cell.data_type = data_type
+        if start is not None:
+            cell.border = merged_data[1]
+        return cell
+
+    def __read_rows(self, min_row, min_col, max_col):
+        # only the cells that will be yielded are bound
+        with self.source._get_source() as source:
+            for row, cells in self.__get_parser(source).parse():
+                if row < min_row:
+                    continue
+                yield row, dict(
+                    (cell['column'], self.__bind_cell(cell['row'], cell['column'], cell['style_id'], cell['value'], cell['data_type']))
+                    for cell in cells if min_col <= cell['column'] <= max_col
+                )
+
+    def __add_merged_cells(self, row, cells, min_col, max_col):
+        for start in self.merged_rows.get(row, ()):
+            merged_range = self.merged_borders[start][0]
+            for column in range(max(merged_range.min_col, min_col), min(merged_range.max_col, max_col) + 1):
+                if column not in cells:
+                    cells[column] = self.__bind_cell(row, column)
+
+    def iter_stored_rows(self, min_row, max_row, min_col, max_col):
+        """(row, {column: cell}) of the rows that are in the xml or covered by a merged range, in order.
+        Only the cells in the xml and the cells of merged ranges are included"""
+        self.__scan()
+        merged_rows = iter(sorted(row for row in self.merged_rows if min_row <= row <= max_row))
+        merged_row = next(merged_rows, None)
+        rows = self.__read_rows(min_row, min_col, max_col)
+        try:
+            xml_row = next(rows, None)
+            while xml_row is not None or merged_row is not None:
+                if xml_row is not None and (merged_row is None or xml_row[0] <= merged_row):
+                    row, cells = xml_row
+                    if row > max_row:
+                        break
+                    xml_row = next(rows, None)
+                else:
+                    row, cells = merged_row, {}
+                if row == merged_row:
+                    self.__add_merged_cells(row, cells, min_col, max_col)
+                    merged_row = next(merged_rows, None)
+                yield row, cells
+        finally:
+            rows.close()
+
+    def cell(self, row, column):
+        """Cell at the given position, created from what the first pass recorded and not stored"""
+        self.__scan()
+        return self.__bind_cell(row, column, self.known_styles.get((row, column)))
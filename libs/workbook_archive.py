@@ -0,0 +1,172 @@
+import io
+import mmap
+import shutil
+import tempfile
+import zipfile
+
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.xml.functions import fromstring
+
+# One xlsx archive per parse, shared by everything that reads the workbook: the sheet fingerprints, the
+# openpyxl readers and the style setup. The upload is spooled once, in memory when it is small and to a
+# memory-mapped temporary file otherwise; files on disk, and uploads the server already spooled to a temporary
+# file, are mapped in place. The central directory is read
+# once and the parts read whole (content types, workbook, relationships, styles, theme) are kept, so no part
+# is inflated twice. Worksheets are streamed from the archive and not kept.
+
+# uploads up to this size are spooled in memory
+SPOOL_MEMORY_BYTES = 8 * 1024 * 1024
+
+
+class MappedFile(io.RawIOBase):
+    """Read-only file over a memory map, which zipfile cannot read from directly"""
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # zipfile expects the OSError of a file when probing before its start
+        try:
+            self.mapped.seek(offset, whence)
+        except ValueError as e:
+            raise OSError(str(e))
+        return self.mapped.tell()
+
+    def tell(self):
+        return self.mapped.tell()
+
+    def read(self, size=-1):
+        return self.mapped.read(size if size is not None and size >= 0 else None)
+
+    def readinto(self, buffer):
+        data = self.mapped.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class WorkbookArchive:
+    """The parts of one xlsx, read from a single spooled copy of it
+
+    It stands in for the zipfile.ZipFile of openpyxl's readers (namelist, read, open, close). Readers
+    close their archive when they are done, so close() leaves it open; release() frees the spooled copy.
+    """
+
+    def __init__(self, source, memory_limit=SPOOL_MEMORY_BYTES):
+        self.path = None
+        self.data = None
+        self.mapped = None
+        self.spooled_file = None
+        self.parts = {}
+        self.trees = {}
+        if isinstance(source, str):
+            self.path = source
+            with open(source, "rb") as source_file:
+                self.__map(source_file)
+        else:
+            source.seek(0, io.SEEK_END)
+            size = source.tell()
+            source.seek(0)
+            if size <= memory_limit:
+                self.data = source.read()
+            elif self.__has_file(source):
+                self.__map(source)
+            else:
+                self.spooled_file = tempfile.NamedTemporaryFile(suffix=".xlsx")
+                shutil.copyfileobj(source, self.spooled_file)
+                self.spooled_file.flush()
+                self.path = self.spooled_file.name
+                self.__map(self.spooled_file)
+            # the caller may read the upload again, as with get_cache_key
+            source.seek(0)
+        self.zip_file = zipfile.ZipFile(MappedFile(self.mapped) if self.mapped is not None else io.BytesIO(self.data))
+        self.NameToInfo = self.zip_file.NameToInfo
+
+    def __has_file(self, source):
+        # werkzeug keeps large uploads in a temporary file, only in-memory streams are copied to one
+        try:
+            source.fileno()
+            return True
+        except (OSError, ValueError, AttributeError):
+            return False
+
+    def __map(self, source_file):
+        # an empty file cannot be mapped, zipfile reports it like any other invalid archive
+        if source_file.seek(0, io.SEEK_END) == 0:
+            self.data = b""
+            return
+        self.mapped = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def namelist(self):
+        return self.zip_file.namelist()
+
+    def read(self, name):
+        part = self.parts.get(name)
+        if part is None:
+            part = self.zip_file.read(name)
+            # xml parts read whole are the workbook level ones, images and the like are read once
+            if name.endswith((".xml", ".rels")):
+                self.parts[name] = part
+        return part
+
+    def open(self, name, mode="r"):
+        if name in self.parts:
+            return io.BytesIO(self.parts[name])
+        return self.zip_file.open(name, mode)
+
+    def get_tree(self, name):
+        """Returns the parsed XML of a part, parsed on first use"""
+        tree = self.trees.get(name)
+        if tree is None:
+            tree = fromstring(self.read(name))
+            self.trees[name] = tree
+        return tree
+
+    def get_path(self):
+        """Returns the path of a file holding the archive, for processes opening it by name"""
+        if self.path is None:
+            self.spooled_file = tempfile.NamedTemporaryFile(suffix=".xlsx")
+            self.spooled_file.write(self.data if self.data is not None else self.mapped)
+            self.spooled_file.flush()
+            self.path = self.spooled_file.name
+        return self.path
+
+    def close(self):
+        pass
+
+    def release(self):
+        self.zip_file.close()
+        self.parts = {}
+        self.trees = {}
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        if self.spooled_file is not None:
+            self.spooled_file.close()
+            self.spooled_file = None
+
+
+class ArchiveExcelReader(ExcelReader):
+    """openpyxl's ExcelReader reading from a WorkbookArchive instead of opening the file again"""
+
+    def __init__(self, archive, read_only=False, data_only=False, keep_links=True):
+        # the attributes ExcelReader.__init__ sets, without its _validate_archive
+        self.archive = archive
+        self.valid_files = archive.namelist()
+        self.read_only = read_only
+        self.keep_vba = False
+        self.data_only = data_only
+        self.keep_links = keep_links
+        self.shared_strings = []
+
+
+def load_archive_workbook(archive):
+    """openpyxl.load_workbook(excel_path, data_only=True) for a WorkbookArchive"""
+    reader = ArchiveExcelReader(archive, data_only=True)
+    reader.read()
+    return reader.wb
@@ -0,0 +1,29 @@
+import io
+import os
+
+import api
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "original", "test.xlsx")
+
+
+def post_stream(client):
+    with open(SAMPLE_PATH, "rb") as excel_file:
+        data = {"file": (io.BytesIO(excel_file.read()), "test.xlsx"), "stream": "1", "range": "A1:D5"}
+    response = client.post("/parse", data=data, content_type="multipart/form-data")
+    # the result is cached once the whole stream has been read
+    response.get_data()
+    return response
+
+
+def test_streamed_result_larger_than_the_cache_is_not_kept(monkeypatch):
+    monkeypatch.setattr(api.result_cache, "max_bytes", 64)
+    monkeypatch.setattr(api.result_cache, "entries", type(api.result_cache.entries)())
+    client = api.app.test_client()
+    skipped = api.metrics_registry.counters["result_cache_skipped"]
+    assert post_stream(client).headers["X-Cache"] == "MISS"
+    assert post_stream(client).headers["X-Cache"] == "MISS"
+    # the chunks were dropped as soon as they passed max_bytes
+    assert api.metrics_registry.counters["result_cache_skipped"] == skipped + 2
+    monkeypatch.setattr(api.result_cache, "max_bytes", 1024 * 1024)
+    post_stream(client)
+    assert post_stream(client).headers["X-Cache"] == "HIT-MEMORY"
@@ -0,0 +1,47 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+from libs import batch_parser
+from libs.batch_parser import extract_zip_workbooks, iter_batch_results
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "original", "test.xlsx")
+
+
+def test_sequential_batch_keeps_no_styles():
+    for processes in [0, 1]:
+        results = dict(iter_batch_results([("a", SAMPLE_PATH), ("b", SAMPLE_PATH)], {}, processes))
+        # the second workbook of the batch finds the styles of the first
+        assert results["b"][2].get("style_cache_hits")
+        assert json.loads(results["a"][0]) == json.loads(results["b"][0])
+    assert batch_parser.worker_style_cache is None
+
+
+def test_pooled_batch():
+    results = dict(iter_batch_results([("a", SAMPLE_PATH), ("b", SAMPLE_PATH)], {}, 2))
+    assert json.loads(results["a"][0]) == json.loads(results["b"][0])
+
+
+def write_zip(zip_path, count):
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        for number in range(count):
+            archive.write(SAMPLE_PATH, "workbook%d.xlsx" % number)
+        archive.writestr("notes.txt", "not a workbook")
+
+
+def test_extract_zip_workbooks(tmp_path):
+    write_zip(str(tmp_path / "batch.zip"), 3)
+    excel_files = extract_zip_workbooks(str(tmp_path / "batch.zip"), str(tmp_path), 10 * 1024 * 1024, 3)
+    assert [name for name, _ in excel_files] == ["workbook0.xlsx", "workbook1.xlsx", "workbook2.xlsx"]
+
+
+@pytest.mark.parametrize("max_bytes, max_files", [(10 * 1024 * 1024, 2), (os.path.getsize(SAMPLE_PATH) * 3 - 1, 3)])
+def test_zip_over_the_limits_is_not_extracted(tmp_path, max_bytes, max_files):
+    write_zip(str(tmp_path / "batch.zip"), 3)
+    directory = tmp_path / "extracted"
+    directory.mkdir()
+    with pytest.raises(ValueError):
+        extract_zip_workbooks(str(tmp_path / "batch.zip"), str(directory), max_bytes, max_files)
+    assert not list(directory.iterdir())
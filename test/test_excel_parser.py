@@ -0,0 +1,139 @@
+import glob
+import json
+import os
+import zipfile
+
+import openpyxl
+import pytest
+
+from benchmark.workbook_generator import generate_workbook
+from libs.excel_parser import ExcelParser
+from libs.metrics import ParseMetrics
+from libs.result_cache import ResultCache
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "original", "test.xlsx")
+
+
+def test_closing_the_json_stream():
+    metrics = ParseMetrics()
+    parser = ExcelParser(metrics)
+    chunks = parser.iter_xlsx_to_json(SAMPLE_PATH)
+    # the document start, the first sheet header and its first row
+    for _ in range(3):
+        next(chunks)
+    errors_swallowed = metrics.counters["errors_swallowed"]
+    # a client going away closes the generator, which releases the workbook and reports nothing
+    chunks.close()
+    assert parser.archive is None
+    assert metrics.counters["errors_swallowed"] == errors_swallowed
+
+
+def test_sheet_cache_keeps_the_output():
+    expected = ExcelParser().parse_xlsx_to_json_file(SAMPLE_PATH)
+    sheet_cache = ResultCache()
+    # the first parses fill the cache, the next ones read from it
+    for _ in range(2):
+        assert ExcelParser(sheet_cache=sheet_cache).parse_xlsx_to_json_file(SAMPLE_PATH) == expected
+        assert "".join(ExcelParser(sheet_cache=sheet_cache).iter_xlsx_to_json(SAMPLE_PATH)) == expected
+    assert "".join(ExcelParser(sheet_cache=ResultCache()).iter_xlsx_to_json(SAMPLE_PATH)) == expected
+
+
+def test_streamed_sheet_larger_than_the_cache_is_not_kept():
+    metrics = ParseMetrics()
+    sheet_cache = ResultCache(max_bytes=256)
+    "".join(ExcelParser(metrics, sheet_cache).iter_xlsx_to_json(SAMPLE_PATH))
+    assert metrics.counters["sheet_cache_skipped"] > 0
+    assert not sheet_cache.entries
+
+
+SPREADSHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIP_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+REVISION_PARTS = {
+    "[Content_Types].xml": (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+        '</Types>'),
+    "_rels/.rels": (
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="%s/officeDocument" Target="xl/workbook.xml"/></Relationships>' % RELATIONSHIP_NS),
+    "xl/workbook.xml": (
+        '<workbook xmlns="%s" xmlns:r="%s"><sheets><sheet name="first" sheetId="1" r:id="rId1"/>'
+        '<sheet name="second" sheetId="2" r:id="rId2"/></sheets></workbook>' % (SPREADSHEET_NS, RELATIONSHIP_NS)),
+    "xl/_rels/workbook.xml.rels": (
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="%s/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="%s/worksheet" Target="worksheets/sheet2.xml"/>'
+        '<Relationship Id="rId3" Type="%s/sharedStrings" Target="sharedStrings.xml"/></Relationships>'
+        % (RELATIONSHIP_NS, RELATIONSHIP_NS, RELATIONSHIP_NS)),
+    "xl/worksheets/sheet1.xml": '<worksheet xmlns="%s"><sheetData><row r="1"><c r="A1" t="s"><v>0</v></c></row></sheetData></worksheet>' % SPREADSHEET_NS,
+    "xl/worksheets/sheet2.xml": '<worksheet xmlns="%s"><sheetData><row r="2"><c r="B2" t="s"><v>1</v></c></row></sheetData></worksheet>' % SPREADSHEET_NS
+}
+
+
+def save_revision(excel_path, second_sheet_text):
+    # openpyxl writes inline strings, Excel keeps the text of every sheet in one shared strings part
+    with zipfile.ZipFile(excel_path, "w") as archive:
+        for name, xml in REVISION_PARTS.items():
+            archive.writestr(name, xml)
+        archive.writestr("xl/sharedStrings.xml", '<sst xmlns="%s"><si><t>unchanged</t></si><si><t>%s</t></si></sst>'
+                         % (SPREADSHEET_NS, second_sheet_text))
+
+
+def test_text_changed_in_one_sheet(tmp_path):
+    sheet_cache = ResultCache()
+    save_revision(str(tmp_path / "first.xlsx"), "before")
+    ExcelParser(sheet_cache=sheet_cache).parse_xlsx_to_json_file(str(tmp_path / "first.xlsx"))
+    # the shared strings of the new revision differ, the strings the first sheet uses do not
+    save_revision(str(tmp_path / "second.xlsx"), "after")
+    metrics = ParseMetrics()
+    result_json = ExcelParser(metrics, sheet_cache).parse_xlsx_to_json_file(str(tmp_path / "second.xlsx"))
+    assert metrics.counters["sheet_cache_hits"] == 1
+    assert metrics.counters["sheet_cache_misses"] == 1
+    assert result_json == ExcelParser().parse_xlsx_to_json_file(str(tmp_path / "second.xlsx"))
+
+
+def assert_same_output(excel_path):
+    expected = ExcelParser().parse_xlsx_to_json_file(excel_path)
+    assert ExcelParser().parse_xlsx_to_json_file(excel_path, engine="stream") == expected
+    assert ExcelParser().parse_xlsx_to_json_file(excel_path, processes=2) == expected
+    assert "".join(ExcelParser().iter_xlsx_to_json(excel_path, engine="stream")) == expected
+
+
+@pytest.mark.parametrize("excel_path", sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "original", "*.xlsx"))))
+def test_engines_give_the_same_output(excel_path):
+    assert_same_output(excel_path)
+
+
+def test_engines_give_the_same_output_with_merges_and_borders(tmp_path):
+    excel_path = str(tmp_path / "generated.xlsx")
+    generate_workbook(excel_path, rows=300, columns=12, sheets=2, merge_density=0.05, border_density=0.5)
+    assert_same_output(excel_path)
+
+
+def test_rows_after_a_long_gap(tmp_path):
+    # mapping used to stop after 50 empty rows in a row
+    workbook = openpyxl.Workbook()
+    workbook.active["A1"] = "first"
+    workbook.active["C200"] = "after the gap"
+    excel_path = str(tmp_path / "gap.xlsx")
+    workbook.save(excel_path)
+    for engine in ["openpyxl", "stream"]:
+        sheets = ExcelParser().iter_xlsx_sheets(excel_path, engine=engine)
+        _, lines = next(sheets)
+        assert [(line["linenumber"], line["columns"][0]["value"]) for line in lines] == [(1, "first"), (200, "after the gap")]
+
+
+def test_sheets_are_left_as_they_are(tmp_path):
+    workbook = openpyxl.Workbook()
+    workbook.active["C3"] = "only cell"
+    excel_path = str(tmp_path / "no_a1.xlsx")
+    workbook.save(excel_path)
+    parser = ExcelParser()
+    result = json.loads(parser.parse_xlsx_to_json_file(excel_path))
+    assert result["sheets"][0]["font"] == {"font": "Calibri", "size": 11}
+    assert list(parser.workbook.worksheets[0]._cells) == [(3, 3)]
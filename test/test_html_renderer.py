@@ -0,0 +1,43 @@
+import os
+
+import openpyxl
+from openpyxl.styles import Font
+
+from libs.excel_parser import ExcelParser
+from libs.html_renderer import get_css_string, get_style_css
+
+HOSTILE_FONT = "x}</style><script>alert(1)</script><style>"
+
+
+def test_css_string():
+    assert get_css_string("Arial") == '"Arial"'
+    assert get_css_string("ＭＳ Ｐゴシック") == '"ＭＳ Ｐゴシック"'
+    assert get_css_string('a"b\\c\nd') == '"a\\22 b\\5C c\\A d"'
+    assert get_css_string(HOSTILE_FONT) == '"x}\\3C /style\\3E \\3C script\\3E alert(1)\\3C /script\\3E \\3C style\\3E "'
+
+
+def test_style_css_escapes_font_names():
+    assert "<" not in get_style_css({"font": {"font": HOSTILE_FONT}})
+
+
+def test_hostile_font_name(tmp_path):
+    workbook = openpyxl.Workbook()
+    # the font of A1 is the table's, the one of B2 gets a rule in a <style> of its own
+    workbook.active.cell(row=1, column=1, value="text").font = Font(name=HOSTILE_FONT, size=11)
+    workbook.active.cell(row=2, column=2, value="text").font = Font(name=HOSTILE_FONT + "2", size=11)
+    excel_path = str(tmp_path / "font.xlsx")
+    workbook.save(excel_path)
+    page = "".join(ExcelParser().iter_xlsx_to_html(excel_path))
+    assert "<script" not in page
+    assert page.count("<style>") == page.count("</style>") == 2
+    assert '.s0{font-family:"x}\\3C /style\\3E ' in page
+
+
+def test_closing_the_html_stream():
+    parser = ExcelParser()
+    chunks = parser.iter_xlsx_to_html(os.path.join(os.path.dirname(__file__), "..", "original", "test.xlsx"))
+    # the page start, the first table start and its first row
+    for _ in range(3):
+        next(chunks)
+    chunks.close()
+    assert parser.archive is None
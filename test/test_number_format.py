@@ -0,0 +1,146 @@
+from datetime import datetime, time, timedelta
+
+import openpyxl
+import pytest
+from openpyxl.styles import Border, Side
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+
+from libs.excel_parser import ExcelParser
+from libs.number_format import ACCOUNTING_FORMATS, CJK_DATE_FORMAT_IDS, NumberFormats, compile_number_format
+
+SECTION_CASES = [
+    ("General", 1234.5, "1234.5"),
+    ("General", 0.1 + 0.2, "0.3"),
+    ("General", 1e20, "1E+20"),
+    ("General", True, "TRUE"),
+    ("0", 2.5, "3"),
+    ("0.00", 1234.567, "1234.57"),
+    ("0.00", 0, "0.00"),
+    ("0.00", -0.001, "0.00"),
+    (".00", 1234.5, "1234.50"),
+    (".00", 0.5, ".50"),
+    ("#,##0", 1234567.8, "1,234,568"),
+    ("#,##0.00", -1234.5, "-1,234.50"),
+    ("#,##0,", 1234567, "1,235"),
+    ("0%", 0.125, "13%"),
+    ('"$"#,##0.00', 1234, "$1,234.00"),
+    ("#,##0.00_);(#,##0.00)", 5, "5.00 "),
+    ("#,##0.00_);(#,##0.00)", -5, "(5.00)"),
+    ('#,##0;-#,##0;"-"', 0, "-"),
+    ("0;-0;0;\"x\"@", "abc", "xabc"),
+]
+
+CONDITION_CASES = [
+    ("[<100]0;0.00", 5, "5"),
+    ("[<100]0;0.00", 500, "500.00"),
+    ('[>=100]0;[<0]"neg";0.0', 5, "5.0"),
+    ('[>=100]0;[<0]"neg";0.0', 150, "150"),
+]
+
+TEXT_CASES = [
+    ("@", "abc", "abc"),
+    ("@", 12.5, "12.5"),
+    ("@", 3, "3"),
+    ('"x"@', 7, "7"),
+    ("0.00", "abc", "abc"),
+]
+
+FRACTION_CASES = [
+    ("# ?/?", 1.25, "1 1/4"),
+    ("# ?/?", -1.5, "-1 1/2"),
+    ("# ??/??", 3.14159, "3 14/99"),
+    ("?/8", 0.5, "4/8"),
+]
+
+EXPONENT_CASES = [
+    ("0.00E+00", 12345, "1.23E+04"),
+    ("0.00E+00", 0.00012, "1.20E-04"),
+    ("0.00E+00", 0, "0.00E+00"),
+    ("##0.0E+0", 12345, "12.3E+3"),
+]
+
+DATE_CASES = [
+    ("mm-dd-yy", datetime(2021, 3, 5), "03-05-21"),
+    ("mmm d, yyyy", datetime(2021, 3, 5), "Mar 5, 2021"),
+    ("dddd", datetime(2021, 3, 5), "Friday"),
+    ("h:mm AM/PM", time(13, 5), "1:05 PM"),
+    ("[h]:mm:ss", timedelta(hours=30, minutes=2), "30:02:00"),
+    ("mm:ss.0", time(0, 1, 2, 500000), "01:02.5"),
+]
+
+# serial numbers formatted as dates, under the two epochs of Excel
+SERIAL_DATE_CASES = [
+    (CALENDAR_WINDOWS_1900, 1, "1900-01-01 0:00"),
+    (CALENDAR_WINDOWS_1900, 61, "1900-03-01 0:00"),
+    (CALENDAR_WINDOWS_1900, 44260.5, "2021-03-05 12:00"),
+    (CALENDAR_MAC_1904, 0, "1904-01-01 0:00"),
+    (CALENDAR_MAC_1904, 44260.5, "2025-03-06 12:00"),
+]
+
+ACCOUNTING_CASES = [
+    (41, 1234, " 1,234 "),
+    (41, -1234, " (1,234)"),
+    (42, 10, " $10 "),
+    (43, 0, " -   "),
+    (44, 10.5, " $10.50 "),
+    (44, -3, " $(3.00)"),
+    (44, 0, " $-   "),
+    (44, "x", " x "),
+]
+
+
+@pytest.mark.parametrize("format_code, value, expected",
+                         SECTION_CASES + CONDITION_CASES + TEXT_CASES + FRACTION_CASES + EXPONENT_CASES + DATE_CASES)
+def test_compile_number_format(format_code, value, expected):
+    assert compile_number_format(format_code)(value, False) == expected
+
+
+@pytest.mark.parametrize("epoch, value, expected", SERIAL_DATE_CASES)
+def test_serial_dates(epoch, value, expected):
+    assert compile_number_format("yyyy-mm-dd h:mm", epoch)(value, False) == expected
+
+
+@pytest.mark.parametrize("number_format_id, value, expected", ACCOUNTING_CASES)
+def test_accounting_formats(number_format_id, value, expected):
+    assert compile_number_format(ACCOUNTING_FORMATS[number_format_id])(value, False) == expected
+
+
+class StyledCell:
+    """The parts of an openpyxl cell NumberFormats reads"""
+
+    def __init__(self, number_format_id):
+        self._style = type("Style", (), {"numFmtId": number_format_id})()
+        self.number_format = "0.00"
+
+
+@pytest.mark.parametrize("number_format_id, value, is_date", [
+    (0, 1234.5, False),
+    (0, "abc", False),
+    (2, 1234.5678, False),
+    (14, datetime(2021, 3, 5, 8, 30), True),
+    (44, 10.5, False),
+    (55, 44260, False),
+])
+def test_raw_values_unchanged(number_format_id, value, is_date):
+    # the values written before formatted values existed
+    expected = value.strftime("%Y/%m/%d") if is_date else value
+    if number_format_id in CJK_DATE_FORMAT_IDS:
+        expected = datetime.fromordinal(datetime(1900, 1, 1).toordinal() + value - 2).strftime("%Y/%m/%d")
+    assert NumberFormats("raw").get_formatter(StyledCell(number_format_id))(value, is_date) == expected
+
+
+def test_formatted_cells_keep_their_border(tmp_path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    side = Side(style="thin", color="000000")
+    for row, value in enumerate([10.5, 0, -3], start=2):
+        cell = sheet.cell(row=row, column=2, value=value)
+        cell.number_format = ACCOUNTING_FORMATS[44]
+        cell.border = Border(top=side, right=side, bottom=side, left=side)
+    excel_path = str(tmp_path / "accounting.xlsx")
+    workbook.save(excel_path)
+    lines = list(ExcelParser().iter_xlsx_sheets(excel_path, values="formatted"))[0][1]
+    # the neighbours of bordered cells are mapped with their side of the border, the values are in B
+    cells = [cell_data for line in lines for cell_data in line["columns"] if cell_data["colnumber"] == "B" and line["linenumber"] > 1]
+    assert [cell_data["value"] for cell_data in cells] == [" $10.50 ", " $-   ", " $(3.00)"]
+    assert all("border" in cell_data for cell_data in cells)
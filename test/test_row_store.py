@@ -0,0 +1,24 @@
+import json
+
+from libs.row_store import RowStore
+
+SHEETS = [({"sheetnumber": 1, "sheetname": "Sheet1"}, [{"linenumber": row, "columns": [{"colnumber": "A", "value": row}]}
+                                                       for row in range(1, 101)])]
+
+
+def test_window(tmp_path):
+    row_store = RowStore(str(tmp_path))
+    row_store.write("a" * 64, SHEETS)
+    assert row_store.get_sheets("a" * 64)[0]["linecount"] == 100
+    assert [line["linenumber"] for line in json.loads(row_store.get_lines_json("a" * 64, 1, 10, 5))] == [10, 11, 12, 13, 14]
+    assert row_store.get_lines_json("b" * 64, 1, 10, 5) is None
+
+
+def test_eviction_keeps_the_written_document(tmp_path):
+    # every document is larger than the store on its own
+    row_store = RowStore(str(tmp_path), max_bytes=1)
+    row_store.write("a" * 64, SHEETS)
+    assert row_store.get_sheets("a" * 64) is not None
+    row_store.write("b" * 64, SHEETS)
+    assert row_store.get_sheets("a" * 64) is None
+    assert len(json.loads(row_store.get_lines_json("b" * 64, 1, 1, 100))) == 100
@@ -0,0 +1,36 @@
+import io
+import os
+import tempfile
+
+from libs.workbook_archive import WorkbookArchive
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "original", "test.xlsx")
+
+
+def read_sample():
+    with open(SAMPLE_PATH, "rb") as excel_file:
+        return excel_file.read()
+
+
+def test_upload_in_a_file_is_mapped_in_place():
+    with tempfile.TemporaryFile() as upload:
+        upload.write(read_sample())
+        archive = WorkbookArchive(upload, memory_limit=0)
+        try:
+            assert archive.spooled_file is None
+            assert "xl/workbook.xml" in archive.namelist()
+            # processes opening the archive by name still get a copy
+            with open(archive.get_path(), "rb") as copy:
+                assert copy.read() == read_sample()
+        finally:
+            archive.release()
+        assert upload.tell() == 0
+
+
+def test_upload_in_memory_is_spooled():
+    archive = WorkbookArchive(io.BytesIO(read_sample()), memory_limit=0)
+    try:
+        assert archive.spooled_file is not None
+        assert "xl/workbook.xml" in archive.namelist()
+    finally:
+        archive.release()